@@ -0,0 +1,70 @@
+# Compare the row wise strftime calendar features, as previously computed in
+# get_papp, with add_calendar_features on synthetic hourly points.
+#   python benchmarks/calendar_features_benchmark.py [years]
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+from home_monitoring_display.panel.calendar_features import add_calendar_features
+
+
+def benchmark(years: int = 5) -> None:
+    # Row wise strftime features, as previously computed, against the
+    # vectorized ones over hourly points
+    times = pd.date_range(
+        "2018-01-01", periods=years * 365 * 24, freq="h", tz="Europe/Paris"
+    )
+    df = pd.DataFrame(
+        {"_time": times, "PAPP": np.random.default_rng(0).uniform(0, 9000, len(times))}
+    )
+
+    starting_time = time.perf_counter()
+    df_rows = df.copy()
+    df_rows["day"] = df_rows._time.dt.day
+    df_rows["day_of_week"] = df_rows._time.dt.day_of_week
+    df_rows["date"] = pd.to_datetime(df_rows._time.dt.date)
+    df_rows["hour"] = df_rows._time.dt.hour
+    df_rows["month_name"] = df_rows._time.apply(lambda d: d.strftime("%B %Y"))
+    df_rows["day_name"] = df_rows._time.apply(lambda d: d.strftime("%A"))
+    df_rows["month"] = df_rows._time.apply(lambda d: d.month)
+    rows_time = time.perf_counter() - starting_time
+
+    starting_time = time.perf_counter()
+    df_vectorized = add_calendar_features(
+        df.assign(PAPP=df.PAPP.astype(np.float32)),
+        ("date", "day", "day_of_week", "day_name", "hour", "month", "month_name"),
+    )
+    vectorized_time = time.perf_counter() - starting_time
+
+    for column in ("date", "day", "day_of_week", "hour", "month"):
+        assert (df_rows[column] == df_vectorized[column]).all(), column
+    for column in ("month_name", "day_name"):
+        assert (df_rows[column] == df_vectorized[column].astype(str)).all(), column
+
+    rows_bytes = df_rows.memory_usage(deep=True).sum()
+    vectorized_bytes = df_vectorized.memory_usage(deep=True).sum()
+
+    print(f"{len(df)} hourly rows")
+    print(f"Row wise features {rows_time:.4f} s, {rows_bytes / 2**20:.1f} MiB")
+    print(
+        f"Vectorized features {vectorized_time:.4f} s, "
+        f"{vectorized_bytes / 2**20:.1f} MiB"
+    )
+
+    starting_time = time.perf_counter()
+    df_rows.groupby(["date", "month_name", "day_of_week"]).agg({"PAPP": "sum"})
+    rows_time = time.perf_counter() - starting_time
+
+    starting_time = time.perf_counter()
+    df_vectorized.groupby(["date", "month_name", "day_of_week"], observed=True).agg(
+        {"PAPP": "sum"}
+    )
+    vectorized_time = time.perf_counter() - starting_time
+
+    print(f"Daily groupby {rows_time:.4f} s against {vectorized_time:.4f} s")
+
+
+if __name__ == "__main__":
+    benchmark(int(sys.argv[1]) if len(sys.argv) > 1 else 5)
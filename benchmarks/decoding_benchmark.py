@@ -0,0 +1,119 @@
+# Compare the DataFrameClient decoding path with the columnar decoding of
+# InfluxDBConnector on a synthetic 1M points result, no InfluxDB server needed.
+#   python benchmarks/decoding_benchmark.py [nb_points]
+import json
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+import pytz
+from influxdb import DataFrameClient
+from influxdb.resultset import ResultSet
+
+from home_monitoring_display.influxdb.query_influxdb import results_to_dataframes
+
+MEASUREMENT = "teleinfo"
+FIELD = "PAPP"
+TIMEZONE = "Europe/Paris"
+
+
+def build_payloads(nb_points: int):
+    times = pd.date_range("2020-01-01", periods=nb_points, freq="10s", tz="UTC")
+    values = np.random.default_rng(0).uniform(0, 9000, nb_points).round(1)
+    # InfluxDB writes whole floats as ints (20.0 as 20), the first value included
+    values[0] = 20
+    values = [int(value) if value.is_integer() else value for value in values]
+
+    def payload(times_values):
+        return json.dumps(
+            {
+                "results": [
+                    {
+                        "statement_id": 0,
+                        "series": [
+                            {
+                                "name": MEASUREMENT,
+                                "columns": ["time", FIELD],
+                                "values": list(map(list, zip(times_values, values))),
+                            }
+                        ],
+                    }
+                ]
+            }
+        )
+
+    rfc3339_payload = payload(times.strftime("%Y-%m-%dT%H:%M:%SZ").tolist())
+    epoch_payload = payload(times.asi8.tolist())
+
+    return rfc3339_payload, epoch_payload
+
+
+def dataframe_client_path(results: list) -> pd.DataFrame:
+    client = DataFrameClient()
+    result_set = ResultSet(results[0])
+
+    df_query = client._to_dataframe(result_set)[MEASUREMENT]
+    df_query = df_query.reset_index(names=["_time"])
+    df_query._time = df_query._time.dt.tz_convert(tz=pytz.timezone(TIMEZONE))
+
+    return df_query
+
+
+def columnar_path(results: list) -> pd.DataFrame:
+    return results_to_dataframes(results, TIMEZONE)[0][MEASUREMENT]
+
+
+def check_whole_floats() -> None:
+    # A float column starting with a whole value must not be decoded as ints
+    results = [
+        {
+            "statement_id": 0,
+            "series": [
+                {
+                    "name": MEASUREMENT,
+                    "columns": ["time", FIELD],
+                    "values": [[0, 20], [10**10, 20.5], [2 * 10**10, 21.7]],
+                }
+            ],
+        }
+    ]
+
+    values = columnar_path(results)[FIELD]
+    assert values.dtype == np.float64, values.dtype
+    assert values.tolist() == [20, 20.5, 21.7], values.tolist()
+
+
+def timeit(func, payload, repeat=3):
+    timings = []
+    for _ in range(repeat):
+        results = json.loads(payload)["results"]
+
+        # JSON parsing is shared by both paths, only decoding is timed
+        starting_time = time.perf_counter()
+        df_result = func(results)
+        timings.append(time.perf_counter() - starting_time)
+
+    return min(timings), df_result
+
+
+if __name__ == "__main__":
+    nb_points = int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000
+
+    check_whole_floats()
+
+    rfc3339_payload, epoch_payload = build_payloads(nb_points)
+
+    reference_time, df_reference = timeit(dataframe_client_path, rfc3339_payload)
+    columnar_time, df_columnar = timeit(columnar_path, epoch_payload)
+
+    pd.testing.assert_frame_equal(df_reference, df_columnar)
+
+    starting_time = time.perf_counter()
+    json.loads(epoch_payload)
+    json_time = time.perf_counter() - starting_time
+
+    print(f"{nb_points} points (JSON parsing {json_time:.3f} s, not included)")
+    print(f"DataFrameClient path {reference_time:.3f} s")
+    print(f"Columnar path        {columnar_time:.3f} s")
+    print(f"Speedup              {reference_time / columnar_time:.1f}x")
@@ -0,0 +1,289 @@
+from typing import Any, AsyncIterator, Dict, List, Literal, Tuple, Union
+import asyncio
+import logging
+import time
+
+import aiohttp
+from influxdb.exceptions import InfluxDBClientError
+import pandas as pd
+
+from home_monitoring_display.influxdb.query_cache import QueryCache
+from home_monitoring_display.influxdb.resilience import backoff_delay
+from home_monitoring_display.influxdb.query_influxdb import (
+    FieldsQuery,
+    FieldsRangeQuery,
+    InfluxDBConnector,
+    results_to_dataframes,
+)
+
+
+class AsyncInfluxDBConnector(InfluxDBConnector):
+    # Same query surface as InfluxDBConnector, awaited on an aiohttp session so
+    # that a slow query does not block the event loop of the Bokeh server
+
+    def _connect(self) -> None:
+        if self.client is None:
+            self.client = aiohttp.ClientSession(
+                base_url=f"http://{self.host}:{self.port}",
+                connector=aiohttp.TCPConnector(limit=self.pool_size),
+                auth=aiohttp.BasicAuth(self.username, self.password),
+                timeout=aiohttp.ClientTimeout(total=self.timeout),
+            )
+
+    async def close(self) -> None:
+        if self.client is not None:
+            await self.client.close()
+            self.client = None
+
+    async def _query(
+        self,
+        query: str,
+        measurement: Union[str, Tuple[str, ...]] = None,
+        deadline: float = None,
+        keep_result: bool = True,
+    ) -> List[Dict[str, pd.DataFrame]]:
+        started = time.perf_counter()
+        call_stats = {"outcome": "coalesced", "bytes": 0}
+
+        cache_key, query_result = self._cached_result(query)
+
+        if query_result is None:
+            query_result = await self.single_flight.do_async(
+                QueryCache.normalize(query),
+                lambda: self._fetch(
+                    query, cache_key, measurement, deadline, call_stats, keep_result
+                ),
+            )
+        else:
+            call_stats["outcome"] = "hit"
+
+        self._record_stats(query, started, query_result, call_stats)
+        return self._copy_result(query_result)
+
+    async def _fetch(
+        self,
+        query: str,
+        cache_key: Any,
+        measurement: Union[str, Tuple[str, ...]],
+        deadline: float,
+        call_stats: Dict,
+        keep_result: bool = True,
+    ) -> List[Dict[str, pd.DataFrame]]:
+        breakers = self._breakers(measurement)
+        call_stats["outcome"] = "stale"
+
+        if not self._allow(breakers):
+            return self._stale_result(query, measurement)
+
+        query_result = await self._request_with_deadline(query, deadline, call_stats)
+        self._record(breakers, measurement, query_result is not None)
+
+        if query_result is None:
+            return self._stale_result(query, measurement)
+
+        call_stats["outcome"] = "miss"
+        if keep_result:
+            self._store_result(query, cache_key, query_result)
+        return query_result
+
+    async def _request_with_deadline(
+        self, query: str, deadline: float = None, call_stats: Dict = None
+    ) -> List[Dict[str, pd.DataFrame]]:
+        end_time = time.monotonic() + (
+            self.query_deadline if deadline is None else deadline
+        )
+
+        for attempt in range(self.query_retries + 1):
+            try:
+                return await asyncio.wait_for(
+                    self._request(query, call_stats),
+                    max(0, end_time - time.monotonic()),
+                )
+
+            except asyncio.TimeoutError:
+                logging.warning(f"InfluxDB query missed its deadline on {self.host}")
+                return None
+
+            except Exception as exception:
+                logging.warning(
+                    f"InfluxDB query failed on {self.host} "
+                    f"(attempt {attempt + 1}): {exception}"
+                )
+
+            remaining = end_time - time.monotonic()
+            if remaining <= 0:
+                return None
+            await asyncio.sleep(backoff_delay(attempt, self.retry_backoff, remaining))
+
+        return None
+
+    async def _request(
+        self, query: str, call_stats: Dict = None
+    ) -> List[Dict[str, pd.DataFrame]]:
+        self._connect()
+
+        async with self.client.get(
+            "/query", params={"q": query, "db": self.database, "epoch": "ns"}
+        ) as response:
+            if response.status != 200:
+                raise InfluxDBClientError(await response.text(), response.status)
+
+            if call_stats is not None:
+                call_stats["bytes"] += len(await response.read())
+
+            results = (await response.json())["results"]
+
+        return results_to_dataframes(results, self.timezone)
+
+    async def get_schema(self):
+        cached_schema, cache_age = self._load_schema_cache()
+
+        fields_database = self._cached_fields(cached_schema, cache_age)
+        updated_at = None if fields_database is None else time.time() - cache_age
+        if fields_database is None:
+            fields_result = await self._query("SHOW FIELD KEYS")
+            if self._unavailable(fields_result):
+                return self._unavailable_schema(cached_schema)
+
+            fields_database = self._fields_query_result(fields_result[0])
+
+        statements = self._schema_statements(
+            fields_database, cached_schema, refresh_first=updated_at is None
+        )
+        query_result = (
+            await self._query(";".join(statements.values())) if statements else []
+        )
+        if statements and self._unavailable(query_result):
+            return self._unavailable_schema(cached_schema)
+
+        schema = self._schema_result(
+            fields_database, cached_schema, statements, query_result
+        )
+        self._save_schema_cache(schema, updated_at)
+
+        return schema
+
+    async def query_field(
+        self,
+        measurement: str,
+        field: str,
+        start: str,
+        stop: str = "now()",
+        groupby_interval: str = None,
+        aggregation_func: str = "mean",
+        deadline: float = None,
+        keep_result: bool = True,
+    ) -> pd.DataFrame:
+        query = self._field_query(
+            measurement, field, start, stop, groupby_interval, aggregation_func
+        )
+
+        return self._field_result(
+            (await self._query(query, measurement, deadline, keep_result))[0],
+            measurement,
+        )
+
+    async def query_fields_ranges(
+        self,
+        range_queries: List[FieldsRangeQuery],
+        groupby_interval: str = None,
+        aggregation_func: str = "mean",
+        deadline: float = None,
+    ) -> Dict[FieldsRangeQuery, Dict[str, pd.DataFrame]]:
+        if len(range_queries) == 0:
+            return {}
+
+        statements = self._fields_range_statements(
+            range_queries, groupby_interval, aggregation_func
+        )
+        query_result = await self._query(
+            ";".join(statements),
+            tuple(dict.fromkeys(query.measurement for query in range_queries)),
+            deadline,
+            # Gaps go to the segment caches, which bound their memory
+            keep_result=False,
+        )
+
+        return self._fields_range_results(range_queries, groupby_interval, query_result)
+
+    async def query_field_chunks(
+        self,
+        measurement: str,
+        field: str,
+        start: str,
+        stop: str = "now()",
+        groupby_interval: str = None,
+        aggregation_func: str = "mean",
+        chunk_freq: str = "MS",
+    ) -> AsyncIterator[pd.DataFrame]:
+        for chunk_start, chunk_stop in self._chunk_windows(start, stop, chunk_freq):
+            df_chunk = await self.query_field(
+                measurement,
+                field,
+                chunk_start,
+                stop=chunk_stop,
+                groupby_interval=groupby_interval,
+                aggregation_func=aggregation_func,
+                # Chunks are consumed once, keeping them would hold them all
+                keep_result=False,
+            )
+
+            if df_chunk is not None:
+                yield df_chunk
+
+    async def query_agg_field(
+        self,
+        measurement: str,
+        field: str,
+        start: str,
+        stop: str = "now()",
+        aggregation_func: str = "mean",
+        deadline: float = None,
+    ) -> pd.DataFrame:
+        query = self._agg_field_query(measurement, field, start, stop, aggregation_func)
+
+        return self._value_result(
+            (await self._query(query, measurement, deadline))[0], measurement, field
+        )
+
+    async def query_time_field(
+        self,
+        measurement: str,
+        field: str,
+        func: Literal["last", "first"] = "last",
+        deadline: float = None,
+    ) -> pd.DataFrame:
+        query = self._time_field_query(measurement, field, func)
+
+        return self._time_result(
+            (await self._query(query, measurement, deadline))[0], measurement
+        )
+
+    async def query_last_field(
+        self,
+        measurement,
+        field: str,
+        deadline: float = None,
+    ):
+        query_last = self._last_field_query(measurement, field)
+
+        return self._value_result(
+            (await self._query(query_last, measurement, deadline))[0],
+            measurement,
+            field,
+        )
+
+    async def query_fields(
+        self, fields_queries: List[FieldsQuery], deadline: float = None
+    ) -> Dict[FieldsQuery, Dict[str, Any]]:
+        if len(fields_queries) == 0:
+            return {}
+
+        statements = self._fields_statements(fields_queries)
+        query_result = await self._query(
+            ";".join(statements.values()),
+            tuple(dict.fromkeys(query.measurement for query in fields_queries)),
+            deadline,
+        )
+
+        return self._fields_results(fields_queries, statements, query_result)
@@ -0,0 +1,151 @@
+from typing import Any, Callable, Dict, List, Tuple
+import atexit
+import logging
+import queue
+import threading
+import time
+
+from home_monitoring_display.influxdb.multi_view_connector import MultiViewConnector
+
+
+class CacheWarmer:
+    # Prefetches date ranges of measures into the caches of a multi view
+    # connector, in background threads, so that the first view of a range does
+    # not wait on InfluxDB. Passes are repeated every interval seconds, at most
+    # concurrency measurements are queried at once, from threads of its own,
+    # and each query is followed by a pause, leaving the connectors and the
+    # executor of the multi view connector to interactive queries
+
+    def __init__(
+        self,
+        multi_view_connector: MultiViewConnector,
+        measures: List[Tuple[str, str, str]],
+        date_ranges: Callable[[], Dict[str, Tuple]],
+        point_budget: int,
+        interval: float = None,
+        concurrency: int = 1,
+        pause: float = 1.0,
+    ) -> None:
+        self.multi_view_connector = multi_view_connector
+        self.measures = measures
+        # Called before each pass, ranges may move with the last date
+        self.date_ranges = date_ranges
+        self.point_budget = point_budget
+        self.interval = interval
+        self.concurrency = concurrency
+        self.pause = pause
+
+        self._cancelled = threading.Event()
+        self._thread = None
+        # No query is started once the server shuts down
+        atexit.register(self.cancel)
+        self._lock = threading.Lock()
+
+        self.passes = 0
+        self.warmed = 0
+        self.failed = 0
+        self.last_pass_time = None
+
+    def _measurement_measures(self) -> List[List[Tuple[str, str, str]]]:
+        # Fields of a measurement are fetched in a single request
+        measurements = {}
+        for measure in self.measures:
+            measurements.setdefault(measure[:2], []).append(measure)
+
+        return list(measurements.values())
+
+    def _warm(self, measures: List[Tuple[str, str, str]], start, stop) -> None:
+        if self._cancelled.is_set():
+            return
+
+        # Same resolution as the plots of the range would request
+        try:
+            groupby_interval = self.multi_view_connector.plan_interval(
+                measures, start, stop, self.point_budget
+            )
+            self.multi_view_connector.query_measures(
+                measures, groupby_interval, start, stop, background=True
+            )
+            with self._lock:
+                self.warmed += 1
+        except Exception:
+            logging.exception(f"Failed to warm {measures} from {start} to {stop}")
+            with self._lock:
+                self.failed += 1
+
+        self._cancelled.wait(self.pause)
+
+    def warm(self) -> None:
+        # One pass over every (range, measurement)
+        starting_time = time.perf_counter()
+
+        pending = queue.Queue()
+        for start, stop in self.date_ranges().values():
+            for measures in self._measurement_measures():
+                pending.put((measures, start, stop))
+
+        def work():
+            while not self._cancelled.is_set():
+                try:
+                    measures, start, stop = pending.get_nowait()
+                except queue.Empty:
+                    return
+                self._warm(measures, start, stop)
+
+        # Daemon threads, a shutdown never waits for a pass to complete
+        workers = [
+            threading.Thread(target=work, daemon=True) for _ in range(self.concurrency)
+        ]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+
+        self.passes += 1
+        self.last_pass_time = time.perf_counter() - starting_time
+
+    def _run(self) -> None:
+        while not self._cancelled.is_set():
+            self.warm()
+
+            if self.interval is None:
+                return
+            self._cancelled.wait(self.interval)
+
+    def start(self) -> None:
+        if self._thread is not None and self._thread.is_alive():
+            return
+
+        self._cancelled.clear()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def cancel(self) -> None:
+        # Queries already sent are completed, pending ones are skipped
+        self._cancelled.set()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "passes": self.passes,
+                "warmed": self.warmed,
+                "failed": self.failed,
+                "last_pass_time": self.last_pass_time,
+            }
+
+
+# Warmers of the shared multi view connectors, a single one runs per connector
+_cache_warmers = {}
+_cache_warmers_lock = threading.Lock()
+
+
+def get_cache_warmer(
+    multi_view_connector: MultiViewConnector, *args, **kwargs
+) -> CacheWarmer:
+    with _cache_warmers_lock:
+        if id(multi_view_connector) not in _cache_warmers:
+            _cache_warmers[id(multi_view_connector)] = CacheWarmer(
+                multi_view_connector, *args, **kwargs
+            )
+
+        return _cache_warmers[id(multi_view_connector)]
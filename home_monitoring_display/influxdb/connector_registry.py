@@ -0,0 +1,70 @@
+from typing import Any, Dict, Type
+import threading
+
+from home_monitoring_display.influxdb.multi_view_connector import MultiViewConnector
+from home_monitoring_display.influxdb.query_influxdb import InfluxDBConnector
+
+# Connectors shared by every dashboard session and inky page of the process,
+# keyed by their class and configuration
+_connectors = {}
+_connectors_lock = threading.Lock()
+# Multi view connectors, keyed by their connectors and configuration, so that
+# sessions share their caches. They read schemas over the network when built,
+# which only blocks the sessions asking for the same key
+_multi_view_connectors = {}
+_multi_view_connectors_locks = {}
+
+
+def _freeze(value: Any) -> Any:
+    if isinstance(value, dict):
+        return tuple(sorted((key, _freeze(item)) for key, item in value.items()))
+    if isinstance(value, (list, tuple)):
+        return tuple(_freeze(item) for item in value)
+    return value
+
+
+def get_connector(
+    connector_class: Type[InfluxDBConnector] = InfluxDBConnector, **config
+) -> InfluxDBConnector:
+    key = (connector_class, _freeze(config))
+
+    with _connectors_lock:
+        if key not in _connectors:
+            _connectors[key] = connector_class(**config)
+
+        return _connectors[key]
+
+
+def get_connectors(
+    connectors_config: dict,
+    connector_class: Type[InfluxDBConnector] = InfluxDBConnector,
+) -> dict:
+    return {
+        name: get_connector(connector_class, **config)
+        for name, config in connectors_config.items()
+    }
+
+
+def get_multi_view_connector(
+    influxdb_connectors: Dict[str, InfluxDBConnector], **config
+) -> MultiViewConnector:
+    key = (
+        tuple((name, id(connector)) for name, connector in influxdb_connectors.items()),
+        _freeze(config),
+    )
+
+    with _connectors_lock:
+        key_lock = _multi_view_connectors_locks.setdefault(key, threading.Lock())
+
+    with key_lock:
+        if key not in _multi_view_connectors:
+            _multi_view_connectors[key] = MultiViewConnector(
+                **config, **influxdb_connectors
+            )
+            return _multi_view_connectors[key]
+
+    # Schemas of a shared connector are refreshed for every new session
+    multi_view_connector = _multi_view_connectors[key]
+    multi_view_connector.refresh_schema()
+
+    return multi_view_connector
@@ -0,0 +1,197 @@
+from typing import Dict, List
+
+import numpy as np
+import pandas as pd
+
+# Resolutions served from the cached points rather than InfluxDB GROUP BY, each
+# level is a multiple of the previous one. Buckets of an hour and more follow
+# local time, as GROUP BY time() tz(), shorter ones are aligned since epoch
+LOD_LEVELS = ("5m", "15m", "30m", "1h", "3h", "6h", "12h", "1d")
+
+HOUR_NS = pd.Timedelta("1h").value
+
+
+def level_ns(level: str) -> int:
+    return pd.Timedelta(level).value
+
+
+def bucket_starts(times: np.ndarray, level: str, timezone: str) -> np.ndarray:
+    # Start (ns since epoch) of the bucket of each time. Hours start on the
+    # local hour and longer levels on local midnight, so a day bucket is a
+    # local day of 23 or 25 hours on DST changes
+    interval = level_ns(level)
+    if interval < HOUR_NS or len(times) == 0:
+        return times // interval * interval
+
+    utc_times = pd.DatetimeIndex(times.view("M8[ns]"), tz="UTC")
+    wall_times = utc_times.tz_convert(timezone).tz_localize(None).asi8
+    if interval == HOUR_NS:
+        return times - (wall_times % interval)
+
+    return (
+        pd.DatetimeIndex((wall_times // interval * interval).view("M8[ns]"))
+        .tz_localize(
+            timezone,
+            ambiguous=np.zeros(len(times), dtype=bool),
+            nonexistent="shift_forward",
+        )
+        .asi8
+    )
+
+
+def floor_time(time: pd.Timestamp, level: str) -> pd.Timestamp:
+    start = bucket_starts(np.array([time.value]), level, str(time.tz))[0]
+    return pd.Timestamp(start, tz=time.tz)
+
+
+def ceil_time(time: pd.Timestamp, level: str) -> pd.Timestamp:
+    start = floor_time(time, level)
+    if start == time:
+        return time
+
+    # Halfway through the next bucket, whatever its length on DST changes
+    return floor_time(start + 1.5 * pd.Timedelta(level), level)
+
+
+def bucket_range(
+    start: pd.Timestamp, stop: pd.Timestamp, level: str, timezone: str
+) -> np.ndarray:
+    # Starts of the buckets of [start, stop), start being a bucket start
+    step = min(level_ns(level), HOUR_NS)
+    return np.unique(
+        bucket_starts(np.arange(start.value, stop.value, step), level, timezone)
+    )
+
+
+def can_derive(level: str, base_interval: str = None) -> bool:
+    # A level is computed from points at base_interval if its buckets are
+    # made of whole base buckets
+    if level not in LOD_LEVELS:
+        return False
+    if base_interval is None:
+        return True
+
+    return level_ns(level) > level_ns(base_interval) and (
+        level_ns(level) % level_ns(base_interval) == 0
+    )
+
+
+def points_stats(df: pd.DataFrame, field: str) -> Dict[str, np.ndarray]:
+    # Each point is a (count, sum, min, max) aggregate of itself, missing
+    # values count for nothing
+    times = df["_time"].array.asi8
+
+    if field not in df:
+        values = np.full(len(times), np.nan)
+    else:
+        values = df[field].to_numpy(dtype=np.float64, na_value=np.nan)
+
+    valid = ~np.isnan(values)
+    return {
+        "_time": times,
+        "count": valid.astype(np.int64),
+        "sum": np.where(valid, values, 0.0),
+        "min": values,
+        "max": values,
+    }
+
+
+def _reduce(stats: Dict[str, np.ndarray], buckets: np.ndarray) -> Dict[str, np.ndarray]:
+    # buckets must be sorted, consecutive rows of a bucket are merged
+    if len(buckets) == 0:
+        return {name: array[:0] for name, array in stats.items()}
+
+    starts = np.concatenate(([0], np.flatnonzero(np.diff(buckets)) + 1))
+    return {
+        "_time": buckets[starts],
+        "count": np.add.reduceat(stats["count"], starts),
+        "sum": np.add.reduceat(stats["sum"], starts),
+        # fmin and fmax ignore NaN, which are empty aggregates
+        "min": np.fmin.reduceat(stats["min"], starts),
+        "max": np.fmax.reduceat(stats["max"], starts),
+    }
+
+
+def reduce_stats(
+    stats: Dict[str, np.ndarray], level: str, timezone: str
+) -> Dict[str, np.ndarray]:
+    # Buckets are aligned as the gaps of the segment caches
+    return _reduce(stats, bucket_starts(stats["_time"], level, timezone))
+
+
+def merge_stats(parts: List[Dict[str, np.ndarray]]) -> Dict[str, np.ndarray]:
+    # Buckets split between two segments are merged back
+    if len(parts) == 0:
+        return {
+            "_time": np.array([], dtype=np.int64),
+            "count": np.array([], dtype=np.int64),
+            "sum": np.array([]),
+            "min": np.array([]),
+            "max": np.array([]),
+        }
+
+    stats = {
+        name: np.concatenate([part[name] for part in parts])
+        for name in ("_time", "count", "sum", "min", "max")
+    }
+    order = np.argsort(stats["_time"], kind="stable")
+
+    return _reduce(
+        {name: array[order] for name, array in stats.items()}, stats["_time"][order]
+    )
+
+
+def stats_to_frame(
+    stats: Dict[str, np.ndarray],
+    field: str,
+    level: str,
+    start: pd.Timestamp,
+    stop: pd.Timestamp,
+    timezone: str,
+) -> pd.DataFrame:
+    # Every bucket of [start, stop) gets a row, as with FILL(null)
+    buckets = bucket_range(start, stop, level, timezone)
+
+    positions = np.searchsorted(buckets, stats["_time"])
+    inside = positions < len(buckets)
+    inside[inside] = buckets[positions[inside]] == stats["_time"][inside]
+    positions = positions[inside]
+
+    count = np.zeros(len(buckets), dtype=np.int64)
+    count[positions] = stats["count"][inside]
+    columns = {
+        "_time": pd.arrays.DatetimeArray(
+            buckets.view("M8[ns]"), dtype=pd.DatetimeTZDtype(tz=timezone)
+        ),
+        field: np.full(len(buckets), np.nan),
+        f"{field}_min": np.full(len(buckets), np.nan),
+        f"{field}_max": np.full(len(buckets), np.nan),
+        f"{field}_count": count,
+    }
+
+    with np.errstate(invalid="ignore", divide="ignore"):
+        columns[field][positions] = stats["sum"][inside] / stats["count"][inside]
+    columns[f"{field}_min"][positions] = stats["min"][inside]
+    columns[f"{field}_max"][positions] = stats["max"][inside]
+
+    return pd.DataFrame(columns, copy=False)
+
+
+def decimate_minmax(df: pd.DataFrame, field: str, max_rows: int) -> pd.DataFrame:
+    # Rows are split in max_rows / 2 runs of consecutive rows, the lowest and
+    # highest values of each run are kept so that peaks stay visible
+    values = df[field].to_numpy(dtype=np.float64, na_value=np.nan)
+    rows = np.flatnonzero(~np.isnan(values))
+
+    if len(rows) <= max_rows:
+        return df.iloc[rows]
+
+    runs = np.arange(len(rows)) * (max_rows // 2) // len(rows)
+    run_starts = np.concatenate(([0], np.flatnonzero(np.diff(runs)) + 1))
+    run_stops = np.concatenate((run_starts[1:], [len(rows)]))
+
+    # Sorted by run then value, a run starts with its lowest value
+    order = np.lexsort((values[rows], runs))
+    kept = np.unique(np.concatenate((order[run_starts], order[run_stops - 1])))
+
+    return df.iloc[rows[kept]]
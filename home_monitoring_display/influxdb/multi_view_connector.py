@@ -1,25 +1,100 @@
-from typing import List
+from typing import Any, Callable, Dict, List, Tuple
+from concurrent.futures import CancelledError, ThreadPoolExecutor
+import datetime as dt
+import threading
 
+import numpy as np
 import pandas as pd
 import pytz
 
-import logging
+from home_monitoring_display.influxdb.lod_pyramid import (
+    LOD_LEVELS,
+    bucket_range,
+    can_derive,
+    ceil_time,
+    decimate_minmax,
+    floor_time,
+    level_ns,
+    merge_stats,
+    points_stats,
+    reduce_stats,
+    stats_to_frame,
+)
+from home_monitoring_display.influxdb.query_cache import QueryCache
+from home_monitoring_display.influxdb.query_influxdb import FieldsRangeQuery
+from home_monitoring_display.influxdb.segment_cache import (
+    SegmentBudget,
+    SegmentCache,
+)
+from home_monitoring_display.influxdb.segment_store import get_segment_store
 
 
 class MultiViewConnector:
-    def __init__(self, **influxdb_connectors):
+    def __init__(
+        self,
+        cache_max_bytes: int = 256 * 2**20,
+        data_dir: str = None,
+        store_max_bytes: int = 2**30,
+        max_rows: int = 20_000,
+        aligned_cache_ttl: float = 60,
+        write_latency: float = 300,
+        **influxdb_connectors,
+    ):
         self.influxdb_connectors = influxdb_connectors
+        # Hard cap on the rows of a returned frame, above it rows are decimated
+        self.max_rows = max_rows
+        # Points may be written up to write_latency seconds after their time,
+        # more recent ranges are never cached as complete
+        self.write_latency = pd.Timedelta(seconds=write_latency)
 
-        self.schema = dict()
-        for connector_name, connector in self.influxdb_connectors.items():
-            connector_schema = connector.get_schema()
-            for measurement, measurement_schema in connector_schema.items():
-                self.schema[(connector_name, measurement)] = measurement_schema
+        self.refresh_schema()
+
+        # Aligned frames of recent (measures, range, resolution) selections
+        self.aligned_cache = QueryCache(max_size=32, ttl=aligned_cache_ttl)
+
+        # Requests of a batch are sent to the connectors concurrently
+        self.executor = ThreadPoolExecutor(max_workers=len(self.influxdb_connectors))
 
         self.timezone = pytz.timezone(
             list(self.influxdb_connectors.values())[0].timezone
         )
-        self._cached_queries = {}
+        self._segment_caches = {}
+        self._segment_caches_lock = threading.Lock()
+        # Median spacing (ns) of the raw points of each measure
+        self._points_spacing = {}
+        # Memory budget shared by the cached segments of every measure
+        self.cache_budget = SegmentBudget(cache_max_bytes)
+        # Cached segments are also kept on disk when a data directory is given
+        self.cache_store = (
+            get_segment_store(data_dir, store_max_bytes)
+            if data_dir is not None
+            else None
+        )
+
+        self.lookups = 0
+        self.hits = 0
+        self.partial_hits = 0
+
+    def refresh_schema(self) -> None:
+        # Connectors schemas are discovered concurrently, last dates move as
+        # new points are written
+        with ThreadPoolExecutor(max_workers=len(self.influxdb_connectors)) as executor:
+            connectors_schema = dict(
+                zip(
+                    self.influxdb_connectors,
+                    executor.map(
+                        lambda connector: connector.get_schema(),
+                        self.influxdb_connectors.values(),
+                    ),
+                )
+            )
+
+        schema = dict()
+        for connector_name, connector_schema in connectors_schema.items():
+            for measurement, measurement_schema in connector_schema.items():
+                schema[(connector_name, measurement)] = measurement_schema
+
+        self.schema = schema
 
     def get_first_date(self):
         return min(
@@ -37,68 +112,570 @@ class MultiViewConnector:
             ]
         )
 
-    def query_measure(
-        self, connector_name: str, measurement: str, field: str, groupby_interval: str, start: str, stop: str
-    ) -> pd.DataFrame:
-        start = start.replace(tzinfo=self.timezone)
-        stop = stop.replace(tzinfo=self.timezone)
+    def _localize(self, time: dt.datetime) -> pd.Timestamp:
+        # Naive datetimes are local times, replace(tzinfo=...) would give pytz
+        # zones their historical LMT offset
+        time = pd.Timestamp(time)
+
+        if time.tzinfo is None:
+            return time.tz_localize(
+                self.timezone, ambiguous=False, nonexistent="shift_forward"
+            )
+        return time.tz_convert(self.timezone)
+
+    def _get_segment_cache(self, key: Tuple) -> SegmentCache:
+        with self._segment_caches_lock:
+            if key not in self._segment_caches:
+                self._segment_caches[key] = SegmentCache(
+                    self.cache_budget, self.cache_store, key, self.timezone.zone
+                )
+
+            return self._segment_caches[key]
+
+    def _record_lookup(self, start: pd.Timestamp, stop: pd.Timestamp, gaps: List):
+        with self._segment_caches_lock:
+            self.lookups += 1
+
+            if len(gaps) == 0:
+                self.hits += 1
+            elif gaps != [(start, stop)]:
+                self.partial_hits += 1
+
+    def cache_stats(self) -> Dict[str, Any]:
+        with self._segment_caches_lock:
+            lookups = {
+                "lookups": self.lookups,
+                "hits": self.hits,
+                "partial_hits": self.partial_hits,
+                "hit_ratio": self.hits / self.lookups if self.lookups > 0 else 0,
+            }
+
+        if self.cache_store is not None:
+            lookups.update(self.cache_store.stats())
+
+        return dict(lookups, **self.cache_budget.stats())
+
+    def _source_interval(
+        self,
+        connector_name: str,
+        measurement: str,
+        field: str,
+        level: str,
+        base_interval: str,
+        start: pd.Timestamp,
+        stop: pd.Timestamp,
+    ) -> str:
+        # Levels are only reduced from base points that are already cached.
+        # Otherwise InfluxDB groups the range at the finest level that fits in
+        # max_rows and coarser levels are reduced from it, so that a long range
+        # never pulls every raw point
+        base_cache = self._get_segment_cache(
+            (connector_name, measurement, field, base_interval)
+        )
+        if len(base_cache.gaps(start, stop)) == 0:
+            return base_interval
+
+        span = (stop - start).value
+        for source in LOD_LEVELS[: LOD_LEVELS.index(level) + 1]:
+            if source != level and not can_derive(level, source):
+                continue
+            if base_interval is not None and not (
+                source == base_interval or can_derive(source, base_interval)
+            ):
+                continue
+            if span / level_ns(source) <= self.max_rows:
+                return source
+
+        return level
+
+    def _plan_measure(
+        self,
+        connector_name: str,
+        measurement: str,
+        field: str,
+        groupby_interval: str,
+        start: dt.datetime,
+        stop: dt.datetime,
+    ) -> Dict[str, Any]:
+        start = self._localize(start)
+        stop = self._localize(stop)
 
         influxdb_connector = self.influxdb_connectors[connector_name]
 
-        if connector_name not in self._cached_queries:
-            self._cached_queries[connector_name] = dict()
+        # Measurements grouped by default are cached at that resolution
+        base_interval = (influxdb_connector.default_group_measurement or {}).get(
+            measurement
+        )
+        if groupby_interval is None:
+            groupby_interval = base_interval
 
-        if measurement not in self._cached_queries[connector_name]:
-            self._cached_queries[connector_name][measurement] = dict()
-            
-        if field not in self._cached_queries[connector_name][measurement]:
-            self._cached_queries[connector_name][measurement][field] = dict()
+        # Raw points that would not fit in max_rows are not fetched to be
+        # decimated, InfluxDB groups them at the finest level that fits. Cached
+        # raw points are still decimated
+        if groupby_interval is None:
+            gaps_points = self._gaps_points(
+                (connector_name, measurement, field), start, stop
+            )
+            if gaps_points is not None and gaps_points > self.max_rows:
+                groupby_interval = self._fitting_level(stop - start, self.max_rows)
 
-        if groupby_interval not in self._cached_queries[connector_name][measurement][field]:
-            # Retrieve data from influxdb
-            df_query = influxdb_connector.query_field(
-                measurement, field, start, stop=stop, groupby_interval=groupby_interval
+        # Pyramid levels are aggregated from points at a finer source resolution
+        lod_level = None
+        if can_derive(groupby_interval, base_interval):
+            lod_level = groupby_interval
+            groupby_interval = self._source_interval(
+                connector_name,
+                measurement,
+                field,
+                lod_level,
+                base_interval,
+                start,
+                stop,
             )
-            # start and stop must be local time timezone unaware datetime
+            if groupby_interval == lod_level:
+                lod_level = None
 
-            field_cache = {"cache": df_query, "start": start, "stop": stop}
+        # Data keeps coming for the current bucket and late points for the last
+        # minutes, they are never cached
+        cutoff = pd.Timestamp.now(tz=self.timezone) - self.write_latency
 
-            self._cached_queries[connector_name][measurement][field][groupby_interval] = field_cache
-            return df_query
-        else:
-            # Retrieve data from cache
-            field_cache = self._cached_queries[connector_name][measurement][field][groupby_interval]
-
-            cached_start = field_cache["start"]
-            cached_stop = field_cache["stop"]
-
-            # Query missing data
-            if start < cached_start:
-                field_cache["cache"] = pd.concat(
-                    [
-                        influxdb_connector.query_field(
-                            measurement, field, start, stop=cached_start
-                        ),
-                        field_cache["cache"],
-                    ],
-                    ignore_index=True,
+        if groupby_interval is not None:
+            # Gaps are aligned on group by buckets so that none of them is split
+            # between two queries
+            cutoff = floor_time(cutoff, groupby_interval)
+
+        for interval in (groupby_interval, lod_level):
+            if interval is not None:
+                start = floor_time(start, interval)
+                stop = ceil_time(stop, interval)
+
+        segment_cache = self._get_segment_cache(
+            (connector_name, measurement, field, groupby_interval)
+        )
+
+        segment_cache.page_in(start, stop)
+
+        # Read before inserting the gaps, which may evict cached segments
+        segments = segment_cache.segments(start, stop)
+        gaps = segment_cache.gaps(start, stop)
+        self._record_lookup(start, stop, gaps)
+
+        return {
+            "connector_name": connector_name,
+            "measurement": measurement,
+            "field": field,
+            "groupby_interval": groupby_interval,
+            "lod_level": lod_level,
+            "start": start,
+            "stop": stop,
+            "cutoff": cutoff,
+            "segment_cache": segment_cache,
+            "segments": segments,
+            "gaps": gaps,
+        }
+
+    def _fetch_gaps(
+        self,
+        plans: List[Dict[str, Any]],
+        background: bool = False,
+        cancelled: Callable[[], bool] = None,
+    ) -> Dict[Tuple, pd.DataFrame]:
+        # Gaps of a connector are read with one request, fields of a measurement
+        # sharing a gap with one SELECT, and connectors are queried concurrently.
+        # Background fetches query them in turn from the calling thread, so
+        # that they never hold the workers of interactive queries. Requests not
+        # yet sent once cancelled() is true raise CancelledError
+        connector_queries = {}
+        for plan in plans:
+            range_queries = connector_queries.setdefault(
+                (plan["connector_name"], plan["groupby_interval"]), {}
+            )
+            for gap_start, gap_stop in plan["gaps"]:
+                fields = range_queries.setdefault(
+                    (plan["measurement"], gap_start, gap_stop), []
                 )
+                if plan["field"] not in fields:
+                    fields.append(plan["field"])
+
+        def query_connector(connector_key):
+            if cancelled is not None and cancelled():
+                raise CancelledError()
+
+            connector_name, groupby_interval = connector_key
+            range_queries = [
+                FieldsRangeQuery(measurement, tuple(fields), gap_start, gap_stop)
+                for (measurement, gap_start, gap_stop), fields in connector_queries[
+                    connector_key
+                ].items()
+            ]
+
+            return self.influxdb_connectors[connector_name].query_fields_ranges(
+                range_queries, groupby_interval=groupby_interval
+            )
+
+        gaps_frames = {}
+        for connector_key, results in zip(
+            connector_queries,
+            (map if background else self.executor.map)(
+                query_connector, connector_queries
+            ),
+        ):
+            for range_query, fields_frames in results.items():
+                for field, df_gap in fields_frames.items():
+                    gaps_frames[
+                        (
+                            *connector_key,
+                            range_query.measurement,
+                            field,
+                            range_query.start,
+                            range_query.stop,
+                        )
+                    ] = df_gap
+
+        return gaps_frames
+
+    def _level_stats(
+        self,
+        segment_cache: SegmentCache,
+        segment_start: pd.Timestamp,
+        df: pd.DataFrame,
+        field: str,
+        level: str,
+        source_interval: str,
+    ) -> Dict[str, np.ndarray]:
+        # Each level is reduced from the previous one when it can be, levels
+        # of cached segments are kept along with them
+        index = LOD_LEVELS.index(level)
+
+        def compute():
+            if index > 0 and can_derive(LOD_LEVELS[index - 1], source_interval):
+                previous_stats = self._level_stats(
+                    segment_cache,
+                    segment_start,
+                    df,
+                    field,
+                    LOD_LEVELS[index - 1],
+                    source_interval,
+                )
+                return reduce_stats(previous_stats, level, self.timezone.zone)
+
+            return reduce_stats(points_stats(df, field), level, self.timezone.zone)
+
+        if segment_cache is None or segment_start is None:
+            return compute()
+        return segment_cache.derived(segment_start, level, compute)
+
+    def _lod_frame(self, plan: Dict[str, Any], fetched: List) -> pd.DataFrame:
+        start, stop = plan["start"].value, plan["stop"].value
+        cached = [(segment_start, df) for segment_start, _, df in plan["segments"]]
+
+        level_stats = [
+            self._level_stats(
+                plan["segment_cache"],
+                segment_start,
+                df,
+                plan["field"],
+                plan["lod_level"],
+                plan["groupby_interval"],
+            )
+            for segment_start, df in cached + fetched
+        ]
 
-                field_cache["start"] = start
-
-            if stop > cached_stop:
-                field_cache["cache"] = pd.concat(
-                    [
-                        field_cache["cache"],
-                        influxdb_connector.query_field(
-                            measurement, field, cached_stop, stop=stop
-                        ),
-                    ],
-                    ignore_index=True,
+        parts = []
+        for stats in level_stats:
+            part_start, part_stop = np.searchsorted(stats["_time"], [start, stop])
+            parts.append(
+                {name: array[part_start:part_stop] for name, array in stats.items()}
+            )
+
+        return stats_to_frame(
+            merge_stats(parts),
+            plan["field"],
+            plan["lod_level"],
+            plan["start"],
+            plan["stop"],
+            self.timezone.zone,
+        )
+
+    def _finish_measure(
+        self, plan: Dict[str, Any], gaps_frames: Dict[Tuple, pd.DataFrame]
+    ) -> pd.DataFrame:
+        cutoff = plan["cutoff"]
+
+        # Fetched frames, along with their segment start once cached
+        fetched = []
+        for gap_start, gap_stop in plan["gaps"]:
+            df_gap = gaps_frames[
+                (
+                    plan["connector_name"],
+                    plan["groupby_interval"],
+                    plan["measurement"],
+                    plan["field"],
+                    gap_start,
+                    gap_stop,
                 )
+            ]
+
+            # Missing or stale results are not cached, the gap is queried again
+            if df_gap is None:
+                continue
+            if df_gap.attrs.get("stale", False) or gap_start >= cutoff:
+                fetched.append((None, df_gap))
+                continue
+            if gap_stop > cutoff:
+                fetched.append((None, df_gap[df_gap["_time"] >= cutoff]))
+                df_gap = df_gap[df_gap["_time"] < cutoff]
+                gap_stop = cutoff
+
+            inserted = plan["segment_cache"].insert(gap_start, gap_stop, df_gap)
+            fetched.append((gap_start if inserted else None, df_gap))
+
+        if plan["lod_level"] is not None:
+            return self._lod_frame(plan, fetched)[["_time", plan["field"]]]
+
+        chunks = [
+            SegmentCache.slice_segment(df, plan["start"], plan["stop"])
+            for _, _, df in plan["segments"]
+        ] + [df for _, df in fetched]
+        chunks = [chunk for chunk in chunks if len(chunk) > 0]
+
+        if len(chunks) == 0:
+            return pd.DataFrame(
+                {
+                    "_time": pd.Series(dtype=pd.DatetimeTZDtype(tz=self.timezone)),
+                    plan["field"]: pd.Series(dtype=float),
+                }
+            )
+        if len(chunks) == 1:
+            # Cached chunks are shared, callers get a shallow copy
+            return chunks[0].copy(deep=False)
+
+        # Chunks do not overlap, ordering them is enough
+        chunks.sort(key=lambda chunk: chunk["_time"].iloc[0])
+        return pd.concat(chunks, ignore_index=True)
+
+    def query_measures(
+        self,
+        measures: List[Tuple[str, str, str]],
+        groupby_interval: str,
+        start: dt.datetime,
+        stop: dt.datetime,
+        background: bool = False,
+        cancelled: Callable[[], bool] = None,
+    ) -> List[pd.DataFrame]:
+        # measures are (connector_name, measurement, field), a frame is returned
+        # for each of them. Queries are abandoned with CancelledError once
+        # cancelled() is true
+        unique_measures = list(dict.fromkeys(measures))
+
+        plans = []
+        for measure in unique_measures:
+            if cancelled is not None and cancelled():
+                raise CancelledError()
+            plans.append(self._plan_measure(*measure, groupby_interval, start, stop))
+        gaps_frames = self._fetch_gaps(plans, background, cancelled)
+
+        measures_frames = {}
+        for measure, plan in zip(unique_measures, plans):
+            df_measure = self._finish_measure(plan, gaps_frames)
+
+            if len(df_measure) > self.max_rows:
+                df_measure = decimate_minmax(df_measure, plan["field"], self.max_rows)
+            measures_frames[measure] = df_measure
+
+        return [measures_frames[measure] for measure in measures]
+
+    def bucketed(self, measures: List[Tuple[str, str, str]], interval: str) -> bool:
+        # Whether interval is a pyramid level of every measure, their frames
+        # are then made of buckets on the same times
+        return all(
+            can_derive(
+                interval,
+                (
+                    self.influxdb_connectors[connector_name].default_group_measurement
+                    or {}
+                ).get(measurement),
+            )
+            for connector_name, measurement, _ in measures
+        )
+
+    def query_aligned(
+        self,
+        measures: List[Tuple[str, str, str]],
+        start: dt.datetime,
+        stop: dt.datetime,
+        interval: str,
+        labels: List[str] = None,
+        cancelled: Callable[[], bool] = None,
+    ) -> pd.DataFrame:
+        # One wide frame with a column per measure on a shared time grid. Pyramid
+        # levels are bucket aggregates, other intervals take the last value
+        # known at each grid time (as-of join)
+        start = self._localize(start)
+        stop = self._localize(stop)
+        if labels is None:
+            labels = [" ".join(measure) for measure in measures]
+
+        key = (tuple(measures), tuple(labels), start.value, stop.value, interval)
+        df_aligned = self.aligned_cache.get(key)
+        if df_aligned is not None:
+            return df_aligned.copy(deep=False)
+
+        bucketed = self.bucketed(measures, interval)
+        measures_frames = self.query_measures(
+            measures, interval if bucketed else None, start, stop, cancelled=cancelled
+        )
 
-                field_cache["stop"] = stop
+        # Bucket starts are aligned as pyramid levels
+        step = pd.Timedelta(interval).value
+        if bucketed:
+            grid = bucket_range(
+                floor_time(start, interval), stop, interval, self.timezone.zone
+            )
+        else:
+            grid = np.arange(start.value, stop.value, step)
+
+        columns = {
+            "_time": pd.arrays.DatetimeArray(
+                grid.view("M8[ns]"), dtype=pd.DatetimeTZDtype(tz=self.timezone.zone)
+            )
+        }
+        for (_, _, field), label, df_measure in zip(measures, labels, measures_frames):
+            times = df_measure["_time"].array.asi8
+            values = (
+                df_measure[field].to_numpy(dtype=np.float64, na_value=np.nan)
+                if field in df_measure
+                else np.full(len(times), np.nan)
+            )
+            column = np.full(len(grid), np.nan)
+
+            if bucketed:
+                # Buckets are placed on the grid time they start at
+                positions = np.searchsorted(grid, times)
+                inside = positions < len(grid)
+                inside[inside] = grid[positions[inside]] == times[inside]
+                column[positions[inside]] = values[inside]
+            elif len(times) > 0:
+                # Last point at or before each grid time, if it is more recent
+                # than a step or the usual spacing of the points
+                tolerance = step
+                if len(times) > 1:
+                    tolerance = max(step, int(np.median(np.diff(times))))
+                positions = np.searchsorted(times, grid, side="right") - 1
+                known = positions >= 0
+                known[known] = grid[known] - times[positions[known]] <= tolerance
+                column[known] = values[positions[known]]
+
+            columns[label] = column
 
-            df_cache = field_cache["cache"]
+        df_aligned = pd.DataFrame(columns, copy=False)
+        self.aligned_cache.put(key, df_aligned)
 
-            return df_cache[(df_cache["_time"] >= start) & (df_cache["_time"] <= stop)]
+        return df_aligned.copy(deep=False)
+
+    def _points_spacing_ns(self, measure: Tuple[str, str, str]) -> float:
+        # Taken from the cached raw points, or else from the points count of
+        # the last day of the measurement. Sensors keep their sampling period
+        # so it is only looked up once
+        spacing = self._points_spacing.get(measure)
+        if spacing is not None:
+            return spacing
+
+        connector_name, measurement, field = measure
+        spacing = self._get_segment_cache((*measure, None)).median_spacing()
+        if spacing is None:
+            last_date = self.schema[(connector_name, measurement)]["last_date"]
+            count = self.influxdb_connectors[connector_name].query_agg_field(
+                measurement,
+                field,
+                last_date - pd.Timedelta("1d"),
+                last_date,
+                aggregation_func="count",
+            )
+            if not count:
+                return None
+            spacing = pd.Timedelta("1d").value / count
+
+        self._points_spacing[measure] = spacing
+        return spacing
+
+    def _gaps_points(
+        self, measure: Tuple[str, str, str], start: pd.Timestamp, stop: pd.Timestamp
+    ) -> float:
+        # Raw points missing from the cache over [start, stop), estimated from
+        # the points spacing
+        gaps_span = sum(
+            (gap_stop - gap_start).value
+            for gap_start, gap_stop in self._get_segment_cache((*measure, None)).gaps(
+                start, stop
+            )
+        )
+        if gaps_span == 0:
+            return 0
+
+        spacing = self._points_spacing_ns(measure)
+        return None if spacing is None else gaps_span / spacing
+
+    def _estimate_points(
+        self, measure: Tuple[str, str, str], start: pd.Timestamp, stop: pd.Timestamp
+    ) -> float:
+        # Rows of the measure over [start, stop) without any count() query, the
+        # cached rows are counted and the gaps estimated from the points spacing
+        connector_name, measurement, _ = measure
+        base_interval = (
+            self.influxdb_connectors[connector_name].default_group_measurement or {}
+        ).get(measurement)
+        if base_interval is not None:
+            return (stop - start).value / level_ns(base_interval)
+
+        segment_cache = self._get_segment_cache((*measure, None))
+        gaps_points = self._gaps_points(measure, start, stop)
+        if gaps_points is None:
+            return None
+
+        return gaps_points + sum(
+            len(chunk) for chunk in segment_cache.slice(start, stop)
+        )
+
+    @staticmethod
+    def _fitting_level(span: pd.Timedelta, max_points: float) -> str:
+        # Finest pyramid level with at most max_points buckets over span
+        for level in LOD_LEVELS:
+            if span.value / level_ns(level) <= max_points:
+                return level
+
+        return LOD_LEVELS[-1]
+
+    def plan_interval(
+        self,
+        measures: List[Tuple[str, str, str]],
+        start: dt.datetime,
+        stop: dt.datetime,
+        point_budget: int,
+    ) -> str:
+        # Raw points are kept when every measure fits in the point budget,
+        # otherwise the finest pyramid level that fits is used
+        start = self._localize(start)
+        stop = self._localize(stop)
+
+        counts = [
+            self._estimate_points(measure, start, stop)
+            for measure in dict.fromkeys(measures)
+        ]
+        if all(count is not None and count <= point_budget for count in counts):
+            return None
+
+        return self._fitting_level(stop - start, point_budget)
+
+    def query_measure(
+        self,
+        connector_name: str,
+        measurement: str,
+        field: str,
+        groupby_interval: str,
+        start: dt.datetime,
+        stop: dt.datetime,
+    ) -> pd.DataFrame:
+        return self.query_measures(
+            [(connector_name, measurement, field)], groupby_interval, start, stop
+        )[0]
@@ -0,0 +1,69 @@
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, Tuple
+import threading
+import time
+
+
+class QueryCache:
+    # LRU cache of query results with a time to live, shared by every caller
+    # of a connector (indicators, sessions, threads)
+
+    def __init__(self, max_size: int = 256, ttl: float = 5) -> None:
+        self.max_size = max_size
+        self.ttl = ttl
+
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def normalize(query: str) -> str:
+        return " ".join(query.split())
+
+    def key(self, query: str) -> Tuple[str, int]:
+        query = self.normalize(query)
+
+        # Relative windows (now() - 10m) give a different result over time, they
+        # are bucketed on the ttl so that all callers of a bucket share a result
+        if "now()" in query:
+            return query, int(time.time() // self.ttl)
+
+        return query, None
+
+    def get(self, key: Hashable) -> Any:
+        with self._lock:
+            entry = self._entries.get(key)
+
+            if entry is None or entry[0] < time.monotonic():
+                if entry is not None:
+                    del self._entries[key]
+                self.misses += 1
+                return None
+
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, key: Hashable, value: Any) -> None:
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            calls = self.hits + self.misses
+            return {
+                "size": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": self.hits / calls if calls > 0 else 0,
+            }
@@ -1,11 +1,100 @@
-from typing import Dict, Literal
+from typing import Any, Dict, Iterator, List, Literal, NamedTuple, Tuple, Union
 import re
 import logging
 import datetime as dt
+import json
+import os
+from pathlib import Path
+import threading
+import time
 
-import pytz
+import numpy as np
 from influxdb import DataFrameClient
+from influxdb.exceptions import InfluxDBClientError
 import pandas as pd
+import requests
+
+from home_monitoring_display.influxdb.query_cache import QueryCache
+from home_monitoring_display.influxdb.query_stats import query_stats
+from home_monitoring_display.influxdb.single_flight import SingleFlight
+from home_monitoring_display.influxdb.resilience import (
+    CircuitBreaker,
+    CircuitBreakers,
+    backoff_delay,
+)
+
+
+def _column_to_array(values: List) -> np.ndarray:
+    # The type of every value is checked, InfluxDB writes whole floats as ints
+    # (20.0 as 20) so the first value does not tell the column type
+    value_types = set(map(type, values))
+    has_null = type(None) in value_types
+    value_types.discard(type(None))
+
+    if value_types == {bool}:
+        return np.array(values, dtype=object if has_null else np.bool_)
+    if value_types == {int} and not has_null:
+        return np.array(values, dtype=np.int64)
+    if value_types and value_types <= {int, float}:
+        # JSON nulls become NaN
+        return np.array(values, dtype=np.float64)
+
+    return np.array(values, dtype=object)
+
+
+def results_to_dataframes(
+    results: List[Dict], timezone: str = "UTC"
+) -> List[Dict[str, pd.DataFrame]]:
+    # Series are expected with epoch (ns) timestamps, each column is decoded into
+    # a typed NumPy array and wrapped into the final DataFrame without copy
+    statements = []
+
+    for statement in results:
+        if "error" in statement:
+            raise InfluxDBClientError(statement["error"])
+
+        frames = {}
+        for series in statement.get("series", []):
+            columns = {}
+            for index, column in enumerate(series["columns"]):
+                values = [row[index] for row in series.get("values", [])]
+
+                if column == "time":
+                    times = np.array(values, dtype=np.int64).view("M8[ns]")
+                    columns["_time"] = pd.arrays.DatetimeArray(
+                        times, dtype=pd.DatetimeTZDtype(tz=timezone)
+                    )
+                    continue
+
+                array = _column_to_array(values)
+
+                # Drop columns without any value, as DataFrameClient does
+                if array.dtype == object and all(value is None for value in values):
+                    continue
+                if array.dtype == np.float64 and np.isnan(array).all():
+                    continue
+
+                columns[column] = array
+
+            frames[series["name"]] = pd.DataFrame(columns, copy=False)
+
+        statements.append(frames)
+
+    return statements
+
+
+class FieldsQuery(NamedTuple):
+    measurement: str
+    fields: Tuple[str, ...]
+    aggregation_func: str = "last"
+    window: str = None
+
+
+class FieldsRangeQuery(NamedTuple):
+    measurement: str
+    fields: Tuple[str, ...]
+    start: Any
+    stop: Any = "now()"
 
 
 class InfluxDBConnector:
@@ -19,6 +108,17 @@ class InfluxDBConnector:
         timeout: int = 20_000,
         timezone: str = "Europe/Paris",
         default_group_measurement: Dict = None,
+        pool_size: int = 10,
+        schema_cache_dir: str = None,
+        schema_cache_ttl: int = 3600,
+        query_cache_size: int = 256,
+        query_cache_ttl: float = 5,
+        query_deadline: float = 30,
+        query_retries: int = 2,
+        retry_backoff: float = 0.5,
+        breaker_threshold: int = 3,
+        breaker_reset_timeout: float = 60,
+        stats_dump_interval: float = None,
         # logger=logging,
     ) -> None:
         self.database = database
@@ -30,9 +130,39 @@ class InfluxDBConnector:
         self.host = host
         self.port = port
 
+        self.pool_size = pool_size
         self.client = None
+        self._connect_lock = threading.Lock()
 
         self.default_group_measurement = default_group_measurement
+
+        self.schema_cache_dir = schema_cache_dir
+        self.schema_cache_ttl = schema_cache_ttl
+
+        # A ttl of 0 disables the query cache
+        self.query_cache = (
+            QueryCache(query_cache_size, query_cache_ttl)
+            if query_cache_ttl > 0
+            else None
+        )
+        self.single_flight = SingleFlight()
+
+        self.query_deadline = query_deadline
+        self.query_retries = query_retries
+        self.retry_backoff = retry_backoff
+        self.circuit_breakers = CircuitBreakers(
+            breaker_threshold, breaker_reset_timeout
+        )
+        # Last good result of the queries, served when a query fails. Chunk and
+        # gap fetches are large and read once, they are not kept
+        self.last_results = QueryCache(query_cache_size, ttl=float("inf"))
+        # Time of the last good result of the measurements served stale, scalar
+        # results cannot carry it as frames do
+        self.stale_since = {}
+
+        # Query stats are periodically logged when an interval is given
+        if stats_dump_interval is not None:
+            query_stats.start_dump(stats_dump_interval)
         # self.logger = logger
 
     @staticmethod
@@ -51,44 +181,439 @@ class InfluxDBConnector:
                 Should either be <1-4 number><letter> or be datetime."""
         )
 
+    def convert_time(self, time_cond) -> pd.Timestamp:
+        now = pd.Timestamp.now(tz=self.timezone)
+
+        if isinstance(time_cond, dt.datetime):
+            return pd.Timestamp(time_cond.timestamp(), unit="s", tz=self.timezone)
+        elif isinstance(time_cond, str):
+            if time_cond == "now()":
+                return now
+            elif bool(re.fullmatch(r"^\d{1,4}[a-zA-Z]$", time_cond)):
+                return now - pd.Timedelta(time_cond)
+
+        raise ValueError(
+            f"""Invalid time condition: {time_cond}.
+                Should either be <1-4 number><letter> or be datetime."""
+        )
+
     def _connect(self) -> None:
-        if self.client is None:
-            self.client = DataFrameClient(
-                self.host,
-                self.port,
-                self.username,
-                self.password,
-                database=self.database,
-                timeout=self.timeout,
+        if self.client is not None:
+            return
+
+        # Connectors are shared between threads, only one of them creates the
+        # client (and its keep-alive connection pool)
+        with self._connect_lock:
+            if self.client is None:
+                self.client = DataFrameClient(
+                    self.host,
+                    self.port,
+                    self.username,
+                    self.password,
+                    database=self.database,
+                    timeout=self.timeout,
+                    pool_size=self.pool_size,
+                )
+
+    def _cached_result(self, query: str) -> Tuple[Any, List[Dict[str, pd.DataFrame]]]:
+        if self.query_cache is None:
+            return None, None
+
+        cache_key = self.query_cache.key(query)
+        return cache_key, self.query_cache.get(cache_key)
+
+    @staticmethod
+    def _copy_result(
+        query_result: List[Dict[str, pd.DataFrame]],
+    ) -> List[Dict[str, pd.DataFrame]]:
+        # Callers get shallow copies, adding columns does not alter shared results
+        return [
+            {measurement: df.copy(deep=False) for measurement, df in frames.items()}
+            for frames in query_result
+        ]
+
+    def _query(
+        self,
+        query: str,
+        measurement: Union[str, Tuple[str, ...]] = None,
+        deadline: float = None,
+        keep_result: bool = True,
+    ) -> List[Dict[str, pd.DataFrame]]:
+        started = time.perf_counter()
+        # Filled by the call fetching the result, left as is for followers
+        call_stats = {"outcome": "coalesced", "bytes": 0}
+
+        cache_key, query_result = self._cached_result(query)
+
+        if query_result is None:
+            # Identical queries running at the same time share one request
+            query_result = self.single_flight.do(
+                QueryCache.normalize(query),
+                lambda: self._fetch(
+                    query, cache_key, measurement, deadline, call_stats, keep_result
+                ),
             )
+        else:
+            call_stats["outcome"] = "hit"
 
-    def get_schema(self):
+        self._record_stats(query, started, query_result, call_stats)
+        return self._copy_result(query_result)
+
+    def _record_stats(
+        self,
+        query: str,
+        started: float,
+        query_result: List[Dict[str, pd.DataFrame]],
+        call_stats: Dict,
+    ) -> None:
+        query_stats.record(
+            query,
+            time.perf_counter() - started,
+            rows=sum(len(df) for frames in query_result for df in frames.values()),
+            received_bytes=call_stats["bytes"],
+            outcome=call_stats["outcome"],
+        )
+
+    def _store_result(
+        self, query: str, cache_key: Any, query_result: List[Dict[str, pd.DataFrame]]
+    ) -> None:
+        if self.query_cache is not None:
+            self.query_cache.put(cache_key, query_result)
+
+        self.last_results.put(QueryCache.normalize(query), (time.time(), query_result))
+
+    @staticmethod
+    def _measurements(measurement: Union[str, Tuple[str, ...]]) -> Tuple[str, ...]:
+        # Batched queries give the measurements of all their statements
+        if measurement is None or isinstance(measurement, str):
+            return (measurement,)
+        return measurement
+
+    def _breakers(
+        self, measurement: Union[str, Tuple[str, ...]]
+    ) -> List[CircuitBreaker]:
+        return [
+            self.circuit_breakers.get(key) for key in self._measurements(measurement)
+        ]
+
+    def _stale_result(
+        self, query: str, measurement: Union[str, Tuple[str, ...]] = None
+    ) -> List[Dict[str, pd.DataFrame]]:
+        last_result = self.last_results.get(QueryCache.normalize(query))
+
+        if last_result is None:
+            # Nothing to serve, the query reads as if measurements were missing
+            return [{} for _ in query.split(";")]
+
+        updated_at, query_result = last_result
+        for key in self._measurements(measurement):
+            self.stale_since[key] = updated_at
+
+        stale_result = self._copy_result(query_result)
+        for frames in stale_result:
+            for df in frames.values():
+                df.attrs["stale"] = True
+                df.attrs["updated_at"] = updated_at
+
+        return stale_result
+
+    def _allow(self, breakers: List[CircuitBreaker]) -> bool:
+        # Every breaker is asked, so that half open ones let this call probe.
+        # A batch is only skipped once all of its measurements are failing
+        return any([breaker.allow() for breaker in breakers])
+
+    def _record(
+        self,
+        breakers: List[CircuitBreaker],
+        measurement: Union[str, Tuple[str, ...]],
+        success: bool,
+    ) -> None:
+        for breaker in breakers:
+            breaker.record(success)
+
+        if success:
+            for key in self._measurements(measurement):
+                self.stale_since.pop(key, None)
+
+    def _fetch(
+        self,
+        query: str,
+        cache_key: Any,
+        measurement: Union[str, Tuple[str, ...]],
+        deadline: float,
+        call_stats: Dict,
+        keep_result: bool = True,
+    ) -> List[Dict[str, pd.DataFrame]]:
+        breakers = self._breakers(measurement)
+        call_stats["outcome"] = "stale"
+
+        if not self._allow(breakers):
+            return self._stale_result(query, measurement)
+
+        query_result = self._request_with_deadline(query, deadline, call_stats)
+        self._record(breakers, measurement, query_result is not None)
+
+        if query_result is None:
+            return self._stale_result(query, measurement)
+
+        call_stats["outcome"] = "miss"
+        if keep_result:
+            self._store_result(query, cache_key, query_result)
+        return query_result
+
+    def _request_with_deadline(
+        self, query: str, deadline: float = None, call_stats: Dict = None
+    ) -> List[Dict[str, pd.DataFrame]]:
         self._connect()
 
-        query_fields = f"SHOW FIELD KEYS"
-        fields_database = self.client.query(query_fields)
+        end_time = time.monotonic() + (
+            self.query_deadline if deadline is None else deadline
+        )
 
-        schema = {}
-        for measurement, fields_meas in fields_database.items():
-            fields = {
-                field_dict["fieldKey"]: field_dict["fieldType"]
-                for field_dict in fields_meas
+        for attempt in range(self.query_retries + 1):
+            try:
+                # The remaining deadline bounds the request itself, so that no
+                # thread is left waiting on a hung node
+                return self._request(
+                    query, call_stats, timeout=end_time - time.monotonic()
+                )
+
+            except requests.exceptions.Timeout:
+                logging.warning(f"InfluxDB query missed its deadline on {self.host}")
+                return None
+
+            except Exception as exception:
+                logging.warning(
+                    f"InfluxDB query failed on {self.host} "
+                    f"(attempt {attempt + 1}): {exception}"
+                )
+
+            remaining = end_time - time.monotonic()
+            if remaining <= 0:
+                return None
+            time.sleep(backoff_delay(attempt, self.retry_backoff, remaining))
+
+        return None
+
+    def _get(self, params: Dict, timeout: float) -> requests.Response:
+        # client.request only takes the client timeout and retries on its own,
+        # so the query is sent on the keep-alive session of the client. Its
+        # _session and _baseurl attributes are private (influxdb 5.x, pinned
+        # in pyproject.toml) and only used here
+        return self.client._session.get(
+            f"{self.client._baseurl}/query",
+            params=params,
+            auth=(self.username, self.password),
+            headers={"Accept": "application/json"},
+            timeout=timeout,
+        )
+
+    def _request(
+        self, query: str, call_stats: Dict = None, timeout: float = None
+    ) -> List[Dict[str, pd.DataFrame]]:
+        self._connect()
+
+        if timeout is not None and timeout <= 0:
+            raise requests.exceptions.Timeout("No time left before the deadline")
+
+        response = self._get(
+            {"q": query, "db": self.database, "epoch": "ns"},
+            self.timeout if timeout is None else timeout,
+        )
+        if response.status_code != 200:
+            raise InfluxDBClientError(response.text, response.status_code)
+
+        if call_stats is not None:
+            call_stats["bytes"] += len(response.content)
+
+        return results_to_dataframes(response.json()["results"], self.timezone)
+
+    @staticmethod
+    def _fields_query_result(statement_result: Dict[str, pd.DataFrame]) -> Dict:
+        return {
+            measurement: dict(zip(df_fields.fieldKey, df_fields.fieldType))
+            for measurement, df_fields in statement_result.items()
+        }
+
+    @property
+    def schema_cache_file(self) -> Path:
+        return Path(self.schema_cache_dir) / (
+            f"schema_{self.host}_{self.port}_{self.database}.json"
+        )
+
+    def _load_schema_cache(self) -> Tuple[Dict, float]:
+        if self.schema_cache_dir is None or not self.schema_cache_file.exists():
+            return None, None
+
+        with open(self.schema_cache_file, "r") as f:
+            schema_cache = json.load(f)
+
+        schema = {
+            measurement: {
+                "fields": measurement_schema["fields"],
+                "first_date": pd.Timestamp(measurement_schema["first_date"]).tz_convert(
+                    self.timezone
+                ),
+                "last_date": pd.Timestamp(measurement_schema["last_date"]).tz_convert(
+                    self.timezone
+                ),
             }
+            for measurement, measurement_schema in schema_cache["schema"].items()
+        }
+
+        return schema, time.time() - schema_cache["updated_at"]
+
+    def _save_schema_cache(self, schema: Dict, updated_at: float = None) -> None:
+        # updated_at is the time field keys and first dates were last read
+        if self.schema_cache_dir is None:
+            return
+
+        schema_cache = {
+            "updated_at": time.time() if updated_at is None else updated_at,
+            "schema": {
+                measurement: {
+                    "fields": measurement_schema["fields"],
+                    "first_date": measurement_schema["first_date"].isoformat(),
+                    "last_date": measurement_schema["last_date"].isoformat(),
+                }
+                for measurement, measurement_schema in schema.items()
+            },
+        }
+
+        self.schema_cache_file.parent.mkdir(parents=True, exist_ok=True)
+        tmp_file = self.schema_cache_file.with_suffix(".tmp")
+        with open(tmp_file, "w") as f:
+            json.dump(schema_cache, f)
+        os.replace(tmp_file, self.schema_cache_file)
+
+    def _schema_statements(
+        self,
+        fields_database: Dict,
+        cached_schema: Dict = None,
+        refresh_first: bool = True,
+    ) -> Dict[Tuple[str, str], str]:
+        statements = {}
+
+        for measurement, fields in fields_database.items():
             first_field = list(fields.keys())[0]
 
-            schema[measurement[0]] = {
+            if cached_schema is not None and measurement in cached_schema:
+                if refresh_first:
+                    statements[(measurement, "first")] = self._time_field_query(
+                        measurement, first_field, func="first"
+                    )
+
+                # Known measurement, only look for points after the cached last date
+                last_date = cached_schema[measurement]["last_date"]
+                statements[(measurement, "last")] = f"""SELECT last({first_field})
+                    FROM {measurement}
+                    WHERE time >= {self.convert_time_cond(last_date)}"""
+            else:
+                for func in ["first", "last"]:
+                    statements[(measurement, func)] = self._time_field_query(
+                        measurement, first_field, func=func
+                    )
+
+        return statements
+
+    @staticmethod
+    def _schema_result(
+        fields_database: Dict,
+        cached_schema: Dict,
+        statements: Dict[Tuple[str, str], str],
+        query_result: List[Dict[str, pd.DataFrame]],
+    ) -> Dict:
+        dates = {}
+        for (measurement, func), statement_result in zip(statements, query_result):
+            if measurement in statement_result:
+                dates[(measurement, func)] = statement_result[measurement][
+                    "_time"
+                ].iloc[0]
+
+        if cached_schema is None:
+            cached_schema = {}
+
+        schema = {}
+        for measurement, fields in fields_database.items():
+            measurement_cache = cached_schema.get(measurement, {})
+
+            schema[measurement] = {
                 "fields": fields,
-                "first_date": (
-                    self.query_time_field(measurement[0], first_field, func="first")
+                "first_date": dates.get(
+                    (measurement, "first"), measurement_cache.get("first_date")
                 ),
-                "last_date": (
-                    self.query_time_field(measurement[0], first_field, func="last")
+                "last_date": dates.get(
+                    (measurement, "last"), measurement_cache.get("last_date")
                 ),
             }
 
         return schema
 
-    def query_field(
+    @staticmethod
+    def _unavailable(query_result: List[Dict[str, pd.DataFrame]]) -> bool:
+        # Served from the last good result, or nothing to serve at all
+        return all(len(frames) == 0 for frames in query_result) or any(
+            df.attrs.get("stale") for frames in query_result for df in frames.values()
+        )
+
+    def _unavailable_schema(self, cached_schema: Dict) -> Dict:
+        # The cached schema is kept as is (and not saved) while InfluxDB is down
+        if cached_schema is None:
+            raise InfluxDBClientError(f"Schema of {self.database} is unavailable")
+
+        logging.warning(f"Serving cached schema of {self.database}, query failed")
+        return cached_schema
+
+    def _cached_fields(self, cached_schema: Dict, cache_age: float) -> Dict:
+        # Field keys of a cache younger than the ttl, None once they are due
+        if cached_schema is None or cache_age >= self.schema_cache_ttl:
+            return None
+
+        return {
+            measurement: measurement_schema["fields"]
+            for measurement, measurement_schema in cached_schema.items()
+        }
+
+    def get_schema(self):
+        cached_schema, cache_age = self._load_schema_cache()
+
+        # Field keys and first dates are only read again once the ttl is over,
+        # last dates always advance from the cached ones (a cheap last() query)
+        fields_database = self._cached_fields(cached_schema, cache_age)
+        updated_at = None if fields_database is None else time.time() - cache_age
+        if fields_database is None:
+            fields_result = self._query("SHOW FIELD KEYS")
+            if self._unavailable(fields_result):
+                return self._unavailable_schema(cached_schema)
+
+            fields_database = self._fields_query_result(fields_result[0])
+
+        # First and last dates of every measurement are read in a single request
+        statements = self._schema_statements(
+            fields_database, cached_schema, refresh_first=updated_at is None
+        )
+        query_result = self._query(";".join(statements.values())) if statements else []
+        if statements and self._unavailable(query_result):
+            return self._unavailable_schema(cached_schema)
+
+        schema = self._schema_result(
+            fields_database, cached_schema, statements, query_result
+        )
+        self._save_schema_cache(schema, updated_at)
+
+        return schema
+
+    def _groupby_interval(self, measurement: str, groupby_interval: str) -> str:
+        if (
+            groupby_interval is None
+            and self.default_group_measurement is not None
+            and measurement in self.default_group_measurement
+        ):
+            return self.default_group_measurement[measurement]
+
+        return groupby_interval
+
+    def _field_query(
         self,
         measurement: str,
         field: str,
@@ -96,94 +621,311 @@ class InfluxDBConnector:
         stop: str = "now()",
         groupby_interval: str = None,
         aggregation_func: str = "mean",
-    ) -> pd.DataFrame:
-        self._connect()
-
-        if (
-            groupby_interval is None
-            and self.default_group_measurement is not None
-            and measurement in self.default_group_measurement
-        ):
-            groupby_interval = self.default_group_measurement[measurement]
+    ) -> str:
+        groupby_interval = self._groupby_interval(measurement, groupby_interval)
+        # Several fields of a measurement can be selected at once
+        fields = (field,) if isinstance(field, str) else field
 
         if groupby_interval is None:
-            query = f"""SELECT {field}
+            return f"""SELECT {", ".join(fields)}
                         FROM {measurement}
-                        WHERE time > {self.convert_time_cond(start)}
+                        WHERE time >= {self.convert_time_cond(start)}
                         AND time < {self.convert_time_cond(stop)}"""
-        else:
-            query = f"""SELECT {aggregation_func}({field}) as {field}
-                        FROM {measurement}
-                        WHERE time > {self.convert_time_cond(start)}
-                        AND time < {self.convert_time_cond(stop)}
-                        GROUP BY time({groupby_interval}) FILL(null)
-                        tz('Europe/Paris')"""
 
-        query_result = self.client.query(query)
+        selectors = ", ".join(
+            f"{aggregation_func}({field}) as {field}" for field in fields
+        )
+        return f"""SELECT {selectors}
+                    FROM {measurement}
+                    WHERE time >= {self.convert_time_cond(start)}
+                    AND time < {self.convert_time_cond(stop)}
+                    GROUP BY time({groupby_interval}) FILL(null)
+                    tz('Europe/Paris')"""
 
-        if len(query_result) == 0:
-            return None
-        try:
-            df_query = query_result[measurement]
+    @staticmethod
+    def _field_result(
+        statement_result: Dict[str, pd.DataFrame], measurement: str
+    ) -> pd.DataFrame:
+        return statement_result.get(measurement)
 
-            df_query = df_query.reset_index(names=["_time"])
-            df_query._time = df_query._time.dt.tz_convert(
-                tz=pytz.timezone(self.timezone)
+    def query_field(
+        self,
+        measurement: str,
+        field: str,
+        start: str,
+        stop: str = "now()",
+        groupby_interval: str = None,
+        aggregation_func: str = "mean",
+        deadline: float = None,
+        keep_result: bool = True,
+    ) -> pd.DataFrame:
+        query = self._field_query(
+            measurement, field, start, stop, groupby_interval, aggregation_func
+        )
+
+        return self._field_result(
+            self._query(query, measurement, deadline, keep_result)[0], measurement
+        )
+
+    def _fields_range_statements(
+        self,
+        range_queries: List[FieldsRangeQuery],
+        groupby_interval: str = None,
+        aggregation_func: str = "mean",
+    ) -> List[str]:
+        return [
+            self._field_query(
+                range_query.measurement,
+                range_query.fields,
+                range_query.start,
+                range_query.stop,
+                groupby_interval,
+                aggregation_func,
             )
+            for range_query in range_queries
+        ]
 
-            return df_query
+    def _fields_range_results(
+        self,
+        range_queries: List[FieldsRangeQuery],
+        groupby_interval: str,
+        query_result: List[Dict[str, pd.DataFrame]],
+    ) -> Dict[FieldsRangeQuery, Dict[str, pd.DataFrame]]:
+        # Each field gets the frame its own query_field call would have returned
+        results = {}
+        for range_query, statement_result in zip(range_queries, query_result):
+            df = statement_result.get(range_query.measurement)
+            grouped = (
+                self._groupby_interval(range_query.measurement, groupby_interval)
+                is not None
+            )
 
-        except KeyError:
-            return None
+            fields_result = results[range_query] = {}
+            for field in range_query.fields:
+                if df is None:
+                    fields_result[field] = None
+                elif grouped:
+                    fields_result[field] = df[
+                        ["_time", field] if field in df else ["_time"]
+                    ]
+                elif field in df and df[field].notna().any():
+                    # Raw rows only hold the fields written at that time
+                    fields_result[field] = df.loc[
+                        df[field].notna(), ["_time", field]
+                    ].reset_index(drop=True)
+                else:
+                    fields_result[field] = None
+
+        return results
+
+    def query_fields_ranges(
+        self,
+        range_queries: List[FieldsRangeQuery],
+        groupby_interval: str = None,
+        aggregation_func: str = "mean",
+        deadline: float = None,
+    ) -> Dict[FieldsRangeQuery, Dict[str, pd.DataFrame]]:
+        # Ranges of several measurements and fields are read with one request
+        if len(range_queries) == 0:
+            return {}
+
+        statements = self._fields_range_statements(
+            range_queries, groupby_interval, aggregation_func
+        )
+        query_result = self._query(
+            ";".join(statements),
+            tuple(dict.fromkeys(query.measurement for query in range_queries)),
+            deadline,
+            # Gaps go to the segment caches, which bound their memory
+            keep_result=False,
+        )
 
-    def query_agg_field(
+        return self._fields_range_results(range_queries, groupby_interval, query_result)
+
+    def _chunk_windows(
+        self, start: str, stop: str, chunk_freq: str
+    ) -> List[Tuple[pd.Timestamp, pd.Timestamp]]:
+        start = self.convert_time(start)
+        stop = self.convert_time(stop)
+
+        # Windows are bounded by local calendar dates (month starts by default)
+        # so that no group by bucket is split between two queries
+        bounds = [
+            bound
+            for bound in pd.date_range(start.normalize(), stop, freq=chunk_freq)
+            if start < bound < stop
+        ]
+
+        return list(zip([start] + bounds, bounds + [stop]))
+
+    def query_field_chunks(
         self,
         measurement: str,
         field: str,
         start: str,
         stop: str = "now()",
+        groupby_interval: str = None,
         aggregation_func: str = "mean",
-    ) -> pd.DataFrame:
-        self._connect()
+        chunk_freq: str = "MS",
+    ) -> Iterator[pd.DataFrame]:
+        for chunk_start, chunk_stop in self._chunk_windows(start, stop, chunk_freq):
+            df_chunk = self.query_field(
+                measurement,
+                field,
+                chunk_start,
+                stop=chunk_stop,
+                groupby_interval=groupby_interval,
+                aggregation_func=aggregation_func,
+                # Chunks are consumed once, keeping them would hold them all
+                keep_result=False,
+            )
+
+            if df_chunk is not None:
+                yield df_chunk
 
-        query = f"""SELECT {aggregation_func}({field}) as {field}
+    def _agg_field_query(
+        self,
+        measurement: str,
+        field: str,
+        start: str,
+        stop: str = "now()",
+        aggregation_func: str = "mean",
+    ) -> str:
+        return f"""SELECT {aggregation_func}({field}) as {field}
                     FROM {measurement}
                     WHERE time > {self.convert_time_cond(start)}
                     AND time < {self.convert_time_cond(stop)}"""
-        try:
-            df_mean_query = self.client.query(query)[measurement]
-            return df_mean_query.iloc[0][field]
 
+    @staticmethod
+    def _value_result(
+        statement_result: Dict[str, pd.DataFrame], measurement: str, field: str
+    ) -> Any:
+        try:
+            return statement_result[measurement].iloc[0][field]
         except KeyError:
             return None
 
+    def query_agg_field(
+        self,
+        measurement: str,
+        field: str,
+        start: str,
+        stop: str = "now()",
+        aggregation_func: str = "mean",
+        deadline: float = None,
+    ) -> pd.DataFrame:
+        query = self._agg_field_query(measurement, field, start, stop, aggregation_func)
+
+        return self._value_result(
+            self._query(query, measurement, deadline)[0], measurement, field
+        )
+
+    @staticmethod
+    def _time_field_query(
+        measurement: str,
+        field: str,
+        func: Literal["last", "first"] = "last",
+    ) -> str:
+        return f"""SELECT {func}({field}) as {field}
+                    FROM {measurement}"""
+
+    @staticmethod
+    def _time_result(
+        statement_result: Dict[str, pd.DataFrame], measurement: str
+    ) -> pd.Timestamp:
+        return statement_result[measurement]["_time"].iloc[0]
+
     def query_time_field(
         self,
         measurement: str,
         field: str,
         func: Literal["last", "first"] = "last",
+        deadline: float = None,
     ) -> pd.DataFrame:
-        self._connect()
+        query = self._time_field_query(measurement, field, func)
 
-        query = f"""SELECT {func}({field}) as {field}
-                    FROM {measurement}"""
+        return self._time_result(
+            self._query(query, measurement, deadline)[0], measurement
+        )
 
-        df_query_result = self.client.query(query)[measurement]
-        return df_query_result.index[0].tz_convert(pytz.timezone(self.timezone))
+    @staticmethod
+    def _last_field_query(measurement: str, field: str) -> str:
+        return f"""SELECT last({field}) as {field}
+                FROM {measurement}"""
 
     def query_last_field(
         self,
         measurement,
         field: str,
+        deadline: float = None,
     ):
-        self._connect()
+        query_last = self._last_field_query(measurement, field)
 
-        query_last = f"""SELECT last({field}) as {field}
-                FROM {measurement}"""
+        return self._value_result(
+            self._query(query_last, measurement, deadline)[0], measurement, field
+        )
 
-        try:
-            df_query_last = self.client.query(query_last)[measurement]
+    def _fields_statements(
+        self, fields_queries: List[FieldsQuery]
+    ) -> Dict[Tuple[str, str], str]:
+        # Fields sharing a measurement and a window are read with one SELECT
+        grouped_selectors = {}
+        for fields_query in fields_queries:
+            group = grouped_selectors.setdefault(
+                (fields_query.measurement, fields_query.window), {}
+            )
+            for field in fields_query.fields:
+                alias = f"{fields_query.aggregation_func}_{field}"
+                group[alias] = f"{fields_query.aggregation_func}({field}) as {alias}"
+
+        statements = {}
+        for (measurement, window), selectors in grouped_selectors.items():
+            statement = f"""SELECT {", ".join(selectors.values())}
+                            FROM {measurement}"""
+            if window is not None:
+                statement += f"""
+                            WHERE time > {self.convert_time_cond(window)}
+                            AND time < now()"""
+            statements[(measurement, window)] = statement
+
+        return statements
 
-            return df_query_last.iloc[0][field]
-        except KeyError:
-            return None
+    @staticmethod
+    def _fields_results(
+        fields_queries: List[FieldsQuery],
+        statements: Dict[Tuple[str, str], str],
+        query_result: List[Dict[str, pd.DataFrame]],
+    ) -> Dict[FieldsQuery, Dict[str, Any]]:
+        values = {}
+        for (measurement, window), statement_result in zip(statements, query_result):
+            if measurement in statement_result:
+                values[(measurement, window)] = statement_result[measurement].iloc[0]
+
+        results = {}
+        for fields_query in fields_queries:
+            row = values.get((fields_query.measurement, fields_query.window))
+            results[fields_query] = {
+                field: (
+                    row.get(f"{fields_query.aggregation_func}_{field}")
+                    if row is not None
+                    else None
+                )
+                for field in fields_query.fields
+            }
+
+        return results
+
+    def query_fields(
+        self, fields_queries: List[FieldsQuery], deadline: float = None
+    ) -> Dict[FieldsQuery, Dict[str, Any]]:
+        if len(fields_queries) == 0:
+            return {}
+
+        statements = self._fields_statements(fields_queries)
+        query_result = self._query(
+            ";".join(statements.values()),
+            tuple(dict.fromkeys(query.measurement for query in fields_queries)),
+            deadline,
+        )
+
+        return self._fields_results(fields_queries, statements, query_result)
@@ -0,0 +1,143 @@
+from collections import Counter, deque
+from typing import Any, Callable, Dict, List
+import logging
+import re
+import threading
+
+import numpy as np
+
+# Literals are replaced so that the same query over other time ranges or
+# values shares one fingerprint
+_LITERALS = re.compile(r"'[^']*'|\b\d+(?:\.\d+)?[a-zµ]*\b")
+
+
+class QueryStats:
+    # In-process registry of the queries run by every connector: wall time,
+    # rows, bytes received and cache outcome, grouped by query fingerprint
+
+    def __init__(self, max_samples: int = 1000) -> None:
+        self.max_samples = max_samples
+
+        self._queries = {}
+        self._lock = threading.Lock()
+        self._dump_timer = None
+
+    @staticmethod
+    def fingerprint(query: str) -> str:
+        return _LITERALS.sub("?", " ".join(query.split()))
+
+    def record(
+        self,
+        query: str,
+        wall_time: float,
+        rows: int = 0,
+        received_bytes: int = 0,
+        outcome: str = "miss",
+    ) -> None:
+        fingerprint = self.fingerprint(query)
+
+        with self._lock:
+            query_stats = self._queries.get(fingerprint)
+
+            if query_stats is None:
+                query_stats = self._queries[fingerprint] = {
+                    "count": 0,
+                    "total_time": 0.0,
+                    "rows": 0,
+                    "bytes": 0,
+                    "outcomes": Counter(),
+                    "wall_times": deque(maxlen=self.max_samples),
+                }
+
+            query_stats["count"] += 1
+            query_stats["total_time"] += wall_time
+            query_stats["rows"] += rows
+            query_stats["bytes"] += received_bytes
+            query_stats["outcomes"][outcome] += 1
+            query_stats["wall_times"].append(wall_time)
+
+    def summary(self) -> List[Dict[str, Any]]:
+        with self._lock:
+            queries = [
+                (fingerprint, dict(query_stats), list(query_stats["wall_times"]))
+                for fingerprint, query_stats in self._queries.items()
+            ]
+
+        summary = []
+        for fingerprint, query_stats, wall_times in queries:
+            p50, p90, p99 = np.percentile(wall_times, [50, 90, 99])
+            summary.append(
+                {
+                    "fingerprint": fingerprint,
+                    "count": query_stats["count"],
+                    "total_time": query_stats["total_time"],
+                    "p50": p50,
+                    "p90": p90,
+                    "p99": p99,
+                    "max": max(wall_times),
+                    "rows": query_stats["rows"],
+                    "bytes": query_stats["bytes"],
+                    "outcomes": dict(query_stats["outcomes"]),
+                }
+            )
+
+        # Hot queries first
+        return sorted(summary, key=lambda stats: stats["total_time"], reverse=True)
+
+    def report(self, top: int = 10) -> str:
+        lines = []
+        for stats in self.summary()[:top]:
+            outcomes = ", ".join(
+                f"{outcome}={count}" for outcome, count in stats["outcomes"].items()
+            )
+            lines.append(
+                f"{stats['count']:>6} calls {stats['total_time']:>8.3f} s "
+                f"p50={stats['p50'] * 1000:.1f} ms p90={stats['p90'] * 1000:.1f} ms "
+                f"p99={stats['p99'] * 1000:.1f} ms rows={stats['rows']} "
+                f"bytes={stats['bytes']} [{outcomes}] {stats['fingerprint']}"
+            )
+
+        return "\n".join(lines)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._queries.clear()
+
+    def start_dump(
+        self, interval: float, output: Callable[[str], None] = logging.info
+    ) -> None:
+        # Periodically writes the report, a single dump runs per registry
+        with self._lock:
+            if self._dump_timer is not None:
+                return
+
+            self._dump_timer = threading.Timer(
+                interval, self._dump, args=(interval, output)
+            )
+            self._dump_timer.daemon = True
+            self._dump_timer.start()
+
+    def _dump(self, interval: float, output: Callable[[str], None]) -> None:
+        report = self.report()
+        if report:
+            output(f"InfluxDB query stats:\n{report}")
+
+        with self._lock:
+            if self._dump_timer is None:
+                return
+
+            self._dump_timer = threading.Timer(
+                interval, self._dump, args=(interval, output)
+            )
+            self._dump_timer.daemon = True
+            self._dump_timer.start()
+
+    def stop_dump(self) -> None:
+        with self._lock:
+            if self._dump_timer is not None:
+                self._dump_timer.cancel()
+                self._dump_timer = None
+
+
+# Registry shared by the connectors of the process
+query_stats = QueryStats()
@@ -0,0 +1,295 @@
+from bisect import bisect_left, bisect_right, insort
+from collections import OrderedDict
+from typing import Any, Callable, Dict, List, Tuple
+import threading
+
+import numpy as np
+import pandas as pd
+
+from home_monitoring_display.influxdb.segment_store import SegmentStore
+
+
+class SegmentCache:
+    # Cached rows of one series at one resolution. Each fetched range is kept
+    # as an immutable chunk sorted by time, along with the [start, stop)
+    # interval it covers, so that only the missing gaps have to be queried
+
+    def __init__(
+        self,
+        budget: "SegmentBudget" = None,
+        store: SegmentStore = None,
+        key: Tuple = None,
+        timezone: str = "UTC",
+    ) -> None:
+        # Sorted and non overlapping (start, stop, df) segments
+        self._segments = []
+        self._starts = []
+        # (segment start, name) -> value derived from the segment
+        self._derived = {}
+        self._lock = threading.Lock()
+
+        self.budget = budget
+        # Segments are persisted in the store under the series key
+        self.store = store
+        self.key = key
+        self.timezone = timezone
+
+    def gaps(
+        self, start: pd.Timestamp, stop: pd.Timestamp
+    ) -> List[Tuple[pd.Timestamp, pd.Timestamp]]:
+        gaps = []
+
+        with self._lock:
+            index = max(bisect_right(self._starts, start) - 1, 0)
+
+            for segment_start, segment_stop, _ in self._segments[index:]:
+                if segment_start >= stop:
+                    break
+                if segment_stop <= start:
+                    continue
+
+                if segment_start > start:
+                    gaps.append((start, segment_start))
+                start = max(start, segment_stop)
+
+        if start < stop:
+            gaps.append((start, stop))
+
+        return gaps
+
+    def insert(
+        self,
+        start: pd.Timestamp,
+        stop: pd.Timestamp,
+        df: pd.DataFrame,
+        persist: bool = True,
+    ) -> bool:
+        # Rows are expected within [start, stop), which must be a gap
+        if not df["_time"].is_monotonic_increasing:
+            df = df.sort_values("_time", ignore_index=True)
+
+        with self._lock:
+            index = bisect_left(self._starts, start)
+
+            # Another caller already filled part of the gap
+            if index > 0 and self._segments[index - 1][1] > start:
+                return False
+            if index < len(self._starts) and self._starts[index] < stop:
+                return False
+
+            insort(self._starts, start)
+            self._segments.insert(index, (start, stop, df))
+
+        if persist and self.store is not None:
+            self.store.write(self.key, start, stop, df)
+
+        # Accounted once released, the budget may evict segments of this cache
+        if self.budget is not None:
+            self.budget.add(self, start, df.memory_usage(index=True, deep=True).sum())
+
+        return True
+
+    def page_in(self, start: pd.Timestamp, stop: pd.Timestamp) -> None:
+        # Rows of the store within [start, stop) that are not in memory
+        # (evicted, or written by another session or a previous run) are mapped,
+        # as long as they fit in the budget, the rest is queried again
+        if self.store is None:
+            return
+
+        paged_bytes = 0
+        for segment_start, segment_stop, path in self.store.segments(
+            self.key, start, stop
+        ):
+            segment_start = pd.Timestamp(segment_start, tz=self.timezone)
+            segment_stop = pd.Timestamp(segment_stop, tz=self.timezone)
+            gaps = self.gaps(max(start, segment_start), min(stop, segment_stop))
+            if len(gaps) == 0:
+                continue
+
+            try:
+                df = self.store.read(path, self.timezone)
+            except FileNotFoundError:
+                # Merged or deleted by another process
+                continue
+
+            for gap_start, gap_stop in gaps:
+                gap_df = self.slice_segment(df, gap_start, gap_stop)
+                nbytes = gap_df.memory_usage(index=True, deep=True).sum()
+                if self.budget is not None and (
+                    paged_bytes + nbytes > self.budget.max_bytes
+                ):
+                    # The first rows that fit, up to the time of the next one
+                    rows = int(
+                        (self.budget.max_bytes - paged_bytes) * len(gap_df) / nbytes
+                    )
+                    if rows > 0:
+                        self.insert(
+                            gap_start,
+                            gap_df["_time"].iloc[rows],
+                            gap_df.iloc[:rows],
+                            persist=False,
+                        )
+                    return
+
+                if self.insert(gap_start, gap_stop, gap_df, persist=False):
+                    paged_bytes += nbytes
+
+    def segments(
+        self, start: pd.Timestamp, stop: pd.Timestamp
+    ) -> List[Tuple[pd.Timestamp, pd.Timestamp, pd.DataFrame]]:
+        # Whole (start, stop, df) segments overlapping [start, stop)
+        with self._lock:
+            index = max(bisect_right(self._starts, start) - 1, 0)
+            segments = [
+                segment
+                for segment in self._segments[index:]
+                if segment[1] > start and segment[0] < stop
+            ]
+
+        if self.budget is not None:
+            for segment_start, _, _ in segments:
+                self.budget.touch(self, segment_start)
+
+        return segments
+
+    @staticmethod
+    def slice_segment(
+        df: pd.DataFrame, start: pd.Timestamp, stop: pd.Timestamp
+    ) -> pd.DataFrame:
+        # Binary search in the sorted chunk, rows are only copied when chunks
+        # are later concatenated
+        chunk_start, chunk_stop = np.searchsorted(
+            df["_time"].array.asi8, [start.value, stop.value], side="left"
+        )
+        return df.iloc[chunk_start:chunk_stop]
+
+    def slice(self, start: pd.Timestamp, stop: pd.Timestamp) -> List[pd.DataFrame]:
+        return [
+            self.slice_segment(df, start, stop)
+            for _, _, df in self.segments(start, stop)
+            if len(df) > 0
+        ]
+
+    def median_spacing(self) -> float:
+        # Usual time (ns) between two consecutive cached rows, None when
+        # nothing is cached
+        with self._lock:
+            diffs = [
+                np.diff(df["_time"].array.asi8)
+                for _, _, df in self._segments
+                if len(df) > 1
+            ]
+
+        if len(diffs) == 0:
+            return None
+        return float(np.median(np.concatenate(diffs)))
+
+    def derived(self, start: pd.Timestamp, name: str, compute: Callable) -> Any:
+        # Values computed from a segment (its aggregates) are kept with it and
+        # dropped when it is evicted
+        with self._lock:
+            value = self._derived.get((start, name))
+        if value is not None:
+            return value
+
+        value = compute()
+
+        with self._lock:
+            index = bisect_left(self._starts, start)
+            if index == len(self._starts) or self._starts[index] != start:
+                return value
+            self._derived[(start, name)] = value
+
+        if self.budget is not None:
+            self.budget.grow(self, start, sum(array.nbytes for array in value.values()))
+
+        return value
+
+    def remove(self, start: pd.Timestamp) -> None:
+        with self._lock:
+            index = bisect_left(self._starts, start)
+
+            if index < len(self._starts) and self._starts[index] == start:
+                del self._starts[index]
+                del self._segments[index]
+
+            for key in [key for key in self._derived if key[0] == start]:
+                del self._derived[key]
+
+    def clear(self) -> None:
+        with self._lock:
+            starts = list(self._starts)
+            self._segments.clear()
+            self._starts.clear()
+            self._derived.clear()
+
+        if self.budget is not None:
+            for start in starts:
+                self.budget.discard(self, start)
+
+
+class SegmentBudget:
+    # Memory budget shared by segment caches, least recently used segments are
+    # evicted once their resident bytes exceed max_bytes
+
+    def __init__(self, max_bytes: int = 256 * 2**20) -> None:
+        self.max_bytes = max_bytes
+
+        # (segment cache id, segment start) -> (segment cache, segment start, bytes)
+        self._segments = OrderedDict()
+        self._lock = threading.Lock()
+
+        self.resident_bytes = 0
+        self.evictions = 0
+        self.evicted_bytes = 0
+
+    def add(self, segment_cache: SegmentCache, start: pd.Timestamp, nbytes: int):
+        evicted = []
+
+        with self._lock:
+            self._segments[(id(segment_cache), start)] = (segment_cache, start, nbytes)
+            self.resident_bytes += nbytes
+
+            # The segment just added is kept even when it exceeds the budget alone
+            while self.resident_bytes > self.max_bytes and len(self._segments) > 1:
+                _, (evicted_cache, evicted_start, evicted_bytes) = (
+                    self._segments.popitem(last=False)
+                )
+                self.resident_bytes -= evicted_bytes
+                self.evictions += 1
+                self.evicted_bytes += evicted_bytes
+                evicted.append((evicted_cache, evicted_start))
+
+        for evicted_cache, evicted_start in evicted:
+            evicted_cache.remove(evicted_start)
+
+    def grow(self, segment_cache: SegmentCache, start: pd.Timestamp, nbytes: int):
+        # Bytes of values derived from a segment, evicted along with it
+        with self._lock:
+            key = (id(segment_cache), start)
+            if key in self._segments:
+                _, _, segment_bytes = self._segments[key]
+                self._segments[key] = (segment_cache, start, segment_bytes + nbytes)
+                self.resident_bytes += nbytes
+
+    def touch(self, segment_cache: SegmentCache, start: pd.Timestamp) -> None:
+        with self._lock:
+            key = (id(segment_cache), start)
+            if key in self._segments:
+                self._segments.move_to_end(key)
+
+    def discard(self, segment_cache: SegmentCache, start: pd.Timestamp) -> None:
+        with self._lock:
+            segment = self._segments.pop((id(segment_cache), start), None)
+            if segment is not None:
+                self.resident_bytes -= segment[2]
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "segments": len(self._segments),
+                "resident_bytes": self.resident_bytes,
+                "max_bytes": self.max_bytes,
+                "evictions": self.evictions,
+                "evicted_bytes": self.evicted_bytes,
+            }
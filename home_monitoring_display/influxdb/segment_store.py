@@ -0,0 +1,185 @@
+from bisect import insort
+from collections import OrderedDict
+from pathlib import Path
+from typing import Dict, List, Tuple
+from urllib.parse import quote
+import os
+import threading
+
+import pandas as pd
+import pyarrow as pa
+
+
+class SegmentStore:
+    # Disk tier of the segment caches: every cached chunk is written as an
+    # Arrow IPC file, read back through a memory map so that restarts and other
+    # sessions page it in without copying nor querying InfluxDB again. Chunks
+    # adjacent to a written one are merged in a single file, and the least
+    # recently used files are deleted once the store exceeds max_bytes
+
+    def __init__(
+        self,
+        data_dir: str,
+        max_bytes: int = 2**30,
+        max_file_bytes: int = 64 * 2**20,
+    ) -> None:
+        self.data_dir = Path(data_dir) / "segments"
+        self.max_bytes = max_bytes
+        # Merged files are rewritten whole, their size bounds the rewrites
+        self.max_file_bytes = max_file_bytes
+
+        # Series directory -> sorted (start, stop, path) of the segments on disk
+        self._index = {}
+        # Path -> (series directory, start, stop, bytes), least recently used first
+        self._files = OrderedDict()
+        self._lock = threading.Lock()
+        # Writes of the process are serialized, a merge reads and deletes files
+        self._write_lock = threading.Lock()
+
+        self.disk_bytes = 0
+        self.disk_evictions = 0
+
+        # Files of previous runs, the oldest ones are deleted first
+        paths = list(self.data_dir.rglob("*.arrow")) if self.data_dir.exists() else []
+        for path in sorted(paths, key=lambda path: path.stat().st_mtime):
+            start, stop = path.stem.split("_")
+            self._add(path.parent, int(start), int(stop), path, path.stat().st_size)
+
+    def _series_dir(self, key: Tuple) -> Path:
+        return self.data_dir.joinpath(*[quote(str(part), safe="") for part in key])
+
+    def _add(self, series_dir: Path, start: int, stop: int, path: Path, nbytes: int):
+        # Called with the lock held
+        insort(self._index.setdefault(series_dir, []), (start, stop, path))
+        self._files[path] = (series_dir, start, stop, nbytes)
+        self.disk_bytes += nbytes
+
+    def _remove(self, path: Path, unlink: bool = True) -> None:
+        # Called with the lock held. Readers that mapped the file keep their
+        # pages until they release them
+        series_dir, start, stop, nbytes = self._files.pop(path)
+        self._index[series_dir].remove((start, stop, path))
+        self.disk_bytes -= nbytes
+        if unlink:
+            path.unlink(missing_ok=True)
+
+    def segments(
+        self, key: Tuple, start: pd.Timestamp, stop: pd.Timestamp
+    ) -> List[Tuple[int, int, Path]]:
+        with self._lock:
+            return [
+                segment
+                for segment in self._index.get(self._series_dir(key), [])
+                if segment[0] < stop.value and segment[1] > start.value
+            ]
+
+    @staticmethod
+    def _read_table(path: Path) -> pa.Table:
+        with pa.memory_map(str(path)) as source:
+            return pa.ipc.open_file(source).read_all()
+
+    def read(self, path: Path, timezone: str) -> pd.DataFrame:
+        # Columns without null values are mapped in place (read only arrays)
+        df = self._read_table(path).to_pandas(split_blocks=True)
+        df["_time"] = df["_time"].dt.tz_convert(timezone)
+
+        with self._lock:
+            if path in self._files:
+                self._files.move_to_end(path)
+
+        return df
+
+    def write(
+        self, key: Tuple, start: pd.Timestamp, stop: pd.Timestamp, df: pd.DataFrame
+    ) -> None:
+        series_dir = self._series_dir(key)
+        series_dir.mkdir(parents=True, exist_ok=True)
+
+        # NaN are kept as values rather than nulls, which would prevent
+        # zero copy reads
+        table = pa.table(
+            {
+                column: pa.array(df[column], from_pandas=df[column].dtype == object)
+                for column in df.columns
+            }
+        )
+
+        with self._write_lock:
+            # Files ending where the segment starts or starting where it stops
+            with self._lock:
+                neighbours = [
+                    segment
+                    for segment in self._index.get(series_dir, [])
+                    if segment[1] == start.value or segment[0] == stop.value
+                ]
+                neighbours_bytes = sum(
+                    self._files[path][3] for _, _, path in neighbours
+                )
+
+            merged = []
+            if neighbours and neighbours_bytes + table.nbytes <= self.max_file_bytes:
+                try:
+                    tables = [self._read_table(path) for _, _, path in neighbours]
+                    # Neighbours are sorted, the left one comes first
+                    if neighbours[0][1] == start.value:
+                        tables.insert(1, table)
+                    else:
+                        tables.insert(0, table)
+                    table = pa.concat_tables(tables)
+                    merged = neighbours
+                except (OSError, pa.ArrowInvalid):
+                    # Deleted by another process, or of another schema
+                    pass
+
+            start_value = min([start.value] + [segment[0] for segment in merged])
+            stop_value = max([stop.value] + [segment[1] for segment in merged])
+            path = series_dir / f"{start_value}_{stop_value}.arrow"
+
+            # Written to a temporary file first so that readers never see a
+            # partial segment
+            tmp_path = path.with_suffix(f".{os.getpid()}.{threading.get_ident()}.tmp")
+            with pa.OSFile(str(tmp_path), "wb") as sink:
+                with pa.ipc.new_file(sink, table.schema) as writer:
+                    writer.write_table(table)
+            os.replace(tmp_path, path)
+
+            with self._lock:
+                for _, _, merged_path in merged:
+                    if merged_path in self._files:
+                        self._remove(merged_path)
+                if path in self._files:
+                    # Replaced by the file just written
+                    self._remove(path, unlink=False)
+                self._add(
+                    series_dir, start_value, stop_value, path, path.stat().st_size
+                )
+
+                # The file just written is kept even when it exceeds the store alone
+                while self.disk_bytes > self.max_bytes and len(self._files) > 1:
+                    self._remove(next(iter(self._files)))
+                    self.disk_evictions += 1
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "disk_segments": len(self._files),
+                "disk_bytes": self.disk_bytes,
+                "disk_max_bytes": self.max_bytes,
+                "disk_evictions": self.disk_evictions,
+            }
+
+
+# Stores shared by the dashboard sessions of the process, keyed by directory.
+# The size limits of the first caller apply to the directory
+_segment_stores = {}
+_segment_stores_lock = threading.Lock()
+
+
+def get_segment_store(data_dir: str, *args, **kwargs) -> SegmentStore:
+    key = str(Path(data_dir).resolve())
+
+    with _segment_stores_lock:
+        if key not in _segment_stores:
+            _segment_stores[key] = SegmentStore(data_dir, *args, **kwargs)
+
+        return _segment_stores[key]
@@ -0,0 +1,84 @@
+from concurrent.futures import Future
+from typing import Any, Awaitable, Callable, Dict, Hashable, Tuple
+import asyncio
+import threading
+
+
+class SingleFlight:
+    # Concurrent calls sharing a key wait on the call already in flight and all
+    # receive its result (or its exception) instead of running it again
+
+    def __init__(self) -> None:
+        self._calls = {}
+        self._async_calls = {}
+        self._lock = threading.Lock()
+
+        self.calls = 0
+        self.executions = 0
+        self.coalesced = 0
+
+    def _join(
+        self, calls: Dict, key: Hashable, new_future: Callable
+    ) -> Tuple[Any, bool]:
+        with self._lock:
+            self.calls += 1
+            future = calls.get(key)
+
+            if future is not None:
+                self.coalesced += 1
+                return future, False
+
+            self.executions += 1
+            future = calls[key] = new_future()
+            return future, True
+
+    def _leave(self, calls: Dict, key: Hashable) -> None:
+        with self._lock:
+            del calls[key]
+
+    def do(self, key: Hashable, func: Callable[[], Any]) -> Any:
+        future, leader = self._join(self._calls, key, Future)
+
+        if not leader:
+            return future.result()
+
+        try:
+            result = func()
+        except BaseException as exception:
+            future.set_exception(exception)
+            raise
+        finally:
+            self._leave(self._calls, key)
+
+        future.set_result(result)
+        return result
+
+    async def do_async(self, key: Hashable, func: Callable[[], Awaitable]) -> Any:
+        future, leader = self._join(
+            self._async_calls, key, asyncio.get_running_loop().create_future
+        )
+
+        if not leader:
+            return await asyncio.shield(future)
+
+        try:
+            result = await func()
+        except BaseException as exception:
+            future.set_exception(exception)
+            # Retrieved here so that a call without followers does not warn
+            future.exception()
+            raise
+        finally:
+            self._leave(self._async_calls, key)
+
+        future.set_result(result)
+        return result
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "calls": self.calls,
+                "executions": self.executions,
+                "coalesced": self.coalesced,
+                "in_flight": len(self._calls) + len(self._async_calls),
+            }
@@ -1,16 +1,18 @@
-from typing import Dict, List
+from typing import Dict, List, Union
 import datetime as dt
 
 from PIL import Image, ImageDraw, ImageFont
 from inky import InkyPHAT
+import numpy as np
 
 from home_monitoring_display.influxdb.query_influxdb import InfluxDBConnector
 from home_monitoring_display.inky.inky_page import InkyPage
+from home_monitoring_display.tariff import Tariff
 
 
 class ElecConsumptionPage(InkyPage):
-    WEEK_PRICE = 0.2352
-    WEEKEND_PRICE = 0.1650
+    # Prices used when the page configuration has no energy_prices
+    ENERGY_PRICES = {"week": 0.2352, "weekend": 0.1650}
     LINE_GROUP_INTER = "5m"
 
     def __init__(
@@ -21,12 +23,14 @@ class ElecConsumptionPage(InkyPage):
         font: str,
         refresh_period: int,
         fields_configuration: Dict,
+        energy_prices: Union[Dict, List[Dict]] = None,
     ) -> None:
         super().__init__(
             inky_display, influxdb_connectors, resources_path, font, refresh_period
         )
 
         self.fields_configuration = fields_configuration
+        self.tariff = Tariff.from_config(energy_prices or self.ENERGY_PRICES)
         self.title_font = ImageFont.truetype(self.font, 12)
         self.header_font = ImageFont.truetype(self.font, 11)
         self.value_font = ImageFont.truetype(self.font, 14)
@@ -44,24 +48,36 @@ class ElecConsumptionPage(InkyPage):
         df_hour_consumption = connector.query_field(
             measurement, app_power_field, "1h", groupby_interval=self.LINE_GROUP_INTER
         )
+        # InfluxDB unreachable without a previous result or no recent points,
+        # the page is not updated
+        if df_hour_consumption is None or len(df_hour_consumption) == 0:
+            return None
         df_hour_consumption = df_hour_consumption.sort_values("_time", ascending=True)
         data[f"line_consumption"] = [
             row[app_power_field] for _, row in df_hour_consumption.iterrows()
         ]
 
-        # Power consumption
+        # Power consumption, hour by hour so that off peak hours are priced
         day_minutes = dt.datetime.now().hour * 60 + dt.datetime.now().minute
-        min_day_power = connector.query_agg_field(
-            measurement, total_power_field, f"{day_minutes}m", aggregation_func="min"
+        df_day_power = connector.query_field(
+            measurement,
+            total_power_field,
+            f"{day_minutes}m",
+            groupby_interval="1h",
+            aggregation_func="min",
         )
         last_power = connector.query_last_field(measurement, total_power_field)
+        if df_day_power is None or last_power is None:
+            return None
+        df_day_power = df_day_power.dropna(subset=[total_power_field])
 
-        data["day_consumption"] = (last_power - min_day_power) / 1000
-        data["day_price"] = (
-            data["day_consumption"] * self.WEEK_PRICE
-            if dt.date.today().weekday() < 5
-            else data["day_consumption"] * self.WEEKEND_PRICE
-        )
+        hour_power = df_day_power[total_power_field].to_numpy()
+        hour_consumption = np.diff(hour_power, append=last_power)
+
+        data["day_consumption"] = hour_consumption.sum() / 1000
+        data["day_price"] = self.tariff.price(
+            df_day_power["_time"], hour_consumption
+        ).sum()
 
         return data
 
@@ -3,7 +3,10 @@ from typing import Dict
 from PIL import Image, ImageDraw, ImageFont
 from inky import InkyPHAT
 
-from home_monitoring_display.influxdb.query_influxdb import InfluxDBConnector
+from home_monitoring_display.influxdb.query_influxdb import (
+    FieldsQuery,
+    InfluxDBConnector,
+)
 from home_monitoring_display.inky.inky_page import InkyPage
 
 
@@ -29,23 +32,40 @@ class HomeMonitorPage(InkyPage):
         self.values_font = ImageFont.truetype(self.font, 14)
 
     def get_data(self) -> Dict:
-        data = {}
+        connectors_queries = {}
 
         for field_cat, config in self.fields_configuration.items():
-            data[field_cat] = {}
-
             if field_cat == "elec":
-                data["elec"]["app_power"] = self.influxdb_connectors[
-                    config["influxdb_connector"]
-                ].query_agg_field(
-                    config["measurement"], config["fields"]["app_power"], "10m"
+                fields_query = FieldsQuery(
+                    config["measurement"],
+                    (config["fields"]["app_power"],),
+                    aggregation_func="mean",
+                    window="10m",
                 )
-
             else:
-                for field_name, field in config["fields"].items():
-                    data[field_cat][field_name] = self.influxdb_connectors[
-                        config["influxdb_connector"]
-                    ].query_last_field(config["measurement"], field)
+                fields_query = FieldsQuery(
+                    config["measurement"], tuple(config["fields"].values())
+                )
+
+            connectors_queries.setdefault(config["influxdb_connector"], {})[
+                field_cat
+            ] = fields_query
+
+        data = {}
+
+        # One request per connector for all the fields of the page
+        for connector_name, fields_queries in connectors_queries.items():
+            results = self.influxdb_connectors[connector_name].query_fields(
+                list(fields_queries.values())
+            )
+
+            for field_cat, fields_query in fields_queries.items():
+                data[field_cat] = {
+                    field_name: results[fields_query][field]
+                    for field_name, field in self.fields_configuration[field_cat][
+                        "fields"
+                    ].items()
+                }
 
         return data
 
@@ -4,7 +4,7 @@ from inky.auto import auto
 import buttonshim
 
 
-from home_monitoring_display.influxdb.query_influxdb import InfluxDBConnector
+from home_monitoring_display.influxdb.connector_registry import get_connectors
 from home_monitoring_display import utils
 from home_monitoring_display.inky.home_monitor_page import HomeMonitorPage
 from home_monitoring_display.inky.day_weather_page import DayWeatherPage
@@ -80,10 +80,7 @@ def main():
 
     inky_config = utils.load_config(config_file)
     connectors_config = utils.load_config(connectors_config_file)
-    # ! I don't love this
-    influxdb_connectors = {
-        name: InfluxDBConnector(**config) for name, config in connectors_config.items()
-    }
+    influxdb_connectors = get_connectors(connectors_config)
 
     page = PAGES_MAPPING[next_page](
         inky_display,
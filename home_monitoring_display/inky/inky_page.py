@@ -140,6 +140,11 @@ class InkyPage(ABC):
 
     def refresh(self) -> None:
         data = self.get_data()
+        # Pages return no data when it could not be retrieved, the previous
+        # image stays displayed
+        if data is None:
+            print("No data retrieved")
+            return
         print("Retrieved data")
         self.display_image(data)
 
@@ -151,6 +156,7 @@ class InkyPage(ABC):
             rx.interval(period=timedelta(seconds=self.refresh_period))
             .pipe(
                 operators.map(lambda i: self.get_data()),
+                operators.filter(lambda data: data is not None),
                 operators.subscribe_on(self.scheduler),
             )
             .subscribe(lambda data: self.display_image(data))
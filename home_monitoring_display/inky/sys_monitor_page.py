@@ -3,7 +3,10 @@ from typing import Dict
 from PIL import Image, ImageDraw, ImageFont
 from inky import InkyPHAT
 
-from home_monitoring_display.influxdb.query_influxdb import InfluxDBConnector
+from home_monitoring_display.influxdb.query_influxdb import (
+    FieldsQuery,
+    InfluxDBConnector,
+)
 from home_monitoring_display.inky.inky_page import InkyPage
 
 # TODO fix monitoring memory values
@@ -48,17 +51,35 @@ class SysMonitorPage(InkyPage):
         data["connector_name"] = self.connector_name
         config = self.fields_configuration[data["connector_name"]]
 
-        for field in ["cpu_usage", "ram_usage"]:
-            data[f"{field}_10m_avg"] = self.influxdb_connectors[
-                data["connector_name"]
-            ].query_agg_field(
-                config[field]["measurement"], config[field]["field"], "10m"
+        fields_queries = {
+            field: FieldsQuery(
+                config[field]["measurement"],
+                (config[field]["field"],),
+                aggregation_func="mean",
+                window="10m",
             )
+            for field in ["cpu_usage", "ram_usage"]
+        }
+        fields_queries.update(
+            {
+                field: FieldsQuery(
+                    config[field]["measurement"], (config[field]["field"],)
+                )
+                for field in ["mem_usage", "cpu_temp"]
+            }
+        )
+
+        results = self.influxdb_connectors[data["connector_name"]].query_fields(
+            list(fields_queries.values())
+        )
+
+        for field in ["cpu_usage", "ram_usage"]:
+            data[f"{field}_10m_avg"] = results[fields_queries[field]][
+                config[field]["field"]
+            ]
 
         for field in ["mem_usage", "cpu_temp"]:
-            data[field] = self.influxdb_connectors[
-                data["connector_name"]
-            ].query_last_field(config[field]["measurement"], config[field]["field"])
+            data[field] = results[fields_queries[field]][config[field]["field"]]
             data[f"max_{field}"] = config[field]["max_value"]
 
         return data
@@ -1,19 +1,19 @@
 import datetime as dt
-from functools import reduce
+from functools import partial
 from pathlib import Path
 import argparse
 
-import pandas as pd
-import hvplot.pandas
 import panel as pn
 from panel.interact import interact
 
-from home_monitoring_display.influxdb.query_influxdb import InfluxDBConnector
-from home_monitoring_display.influxdb.multi_view_connector import MultiViewConnector
+from home_monitoring_display.influxdb.cache_warmer import get_cache_warmer
+from home_monitoring_display.influxdb.connector_registry import (
+    get_connector,
+    get_multi_view_connector,
+)
+from home_monitoring_display.panel.measures_view import MeasuresView
 from home_monitoring_display.utils import extract_configs
 
-# TODO Adaptative range interval
-
 
 def get_date_range(date_range, first_date):
     if date_range[0] < first_date:
@@ -21,69 +21,33 @@ def get_date_range(date_range, first_date):
     return {"value": date_range}
 
 
-# not used
-# TODO must interact with cache
-def get_groupby_interval(start, stop):
-    time_delta = stop - start
-
-    if time_delta >= dt.timedelta(days=60):
-        return "1h"
-    if time_delta >= dt.timedelta(days=30):
-        return "30m"
-    if time_delta >= dt.timedelta(days=7):
-        return "15m"
-    if time_delta >= dt.timedelta(days=1):
-        return "5m"
-    return None
-
-
-def plot_measures(
-    multi_view_connector, measures, group_plots, smooth_plots, date_range
-):
-    start = pd.Timestamp(date_range[0]).replace(tzinfo=multi_view_connector.timezone)
-    stop = pd.Timestamp(date_range[1]).replace(tzinfo=multi_view_connector.timezone)
-
-    if smooth_plots:
-        groupby_interval = get_groupby_interval(start, stop)
-    else:
-        groupby_interval = None
-
-    if len(measures) == 0:
-        return pn.pane.Markdown("## No measures Selected")
-
-    if len(measures) == 1:
-        return pn.pane.HoloViews(
-            multi_view_connector.query_measure(
-                *measures[0][1:],
-                groupby_interval=groupby_interval,
-                start=start,
-                stop=stop
-            )
-            .rename(
-                columns={measures[0][3]: " ".join((measures[0][0], measures[0][3]))}
-            )
-            .hvplot(x="_time"),
-            sizing_mode="stretch_both",
-        )
+def get_date_presets(first_date, last_date):
+    return {
+        "2 heures": (last_date - dt.timedelta(hours=2), last_date),
+        "12 heures": (last_date - dt.timedelta(hours=12), last_date),
+        "1 jour": (last_date - dt.timedelta(days=1), last_date),
+        "2 jours": (last_date - dt.timedelta(days=2), last_date),
+        "1 semaine": (last_date - dt.timedelta(days=7), last_date),
+        "1 mois": (last_date - dt.timedelta(days=30), last_date),
+        "Tout": (first_date, last_date),
+    }
 
-    list_plots = [
-        multi_view_connector.query_measure(
-            *measure[1:], groupby_interval=groupby_interval, start=start, stop=stop
-        )
-        .rename(columns={measure[3]: " ".join((measure[0], measure[3]))})
-        .hvplot(x="_time", responsive=True)
-        for measure in measures
-    ]
-    if group_plots:
-        return pn.pane.HoloViews(
-            reduce(lambda x, y: x * y, list_plots).opts(show_legend=True),
-            sizing_mode="stretch_both",
-        )
-    else:
-        return pn.pane.HoloViews(
-            reduce(lambda x, y: x + y, list_plots).cols(1),
-            sizing_mode="stretch_both",
-        )
+
+def get_warmed_presets(multi_view_connector, presets=None):
+    # Presets as the next session would see them
+    multi_view_connector.refresh_schema()
+    date_presets = get_date_presets(
+        multi_view_connector.get_first_date().replace(tzinfo=None),
+        multi_view_connector.get_last_date().replace(tzinfo=None),
+    )
+
+    if presets is None:
+        return date_presets
+    return {preset: date_presets[preset] for preset in presets}
+
+
+# Points per plotted series, about two per pixel of a plot
+POINT_BUDGET = 2000
 
 
 def build_dashboard():
@@ -103,23 +67,18 @@ def build_dashboard():
             **analytics_conf[connector_name].get("extra_params", {})
         )
 
-        influxdb_connectors[connector_name] = InfluxDBConnector(**conf)
+        influxdb_connectors[connector_name] = get_connector(**conf)
 
-    multi_view_connector = MultiViewConnector(**influxdb_connectors)
+    # Shared by the sessions, along with its caches
+    multi_view_connector = get_multi_view_connector(
+        influxdb_connectors, **analytics_conf.get("multi_view_connector", {})
+    )
 
     first_date = multi_view_connector.get_first_date().replace(tzinfo=None)
     last_date = multi_view_connector.get_last_date().replace(tzinfo=None)
 
     date_range_select = pn.widgets.Select(
-        options={
-            "2 heures": (last_date - dt.timedelta(hours=2), last_date),
-            "12 heures": (last_date - dt.timedelta(hours=12), last_date),
-            "1 jour": (last_date - dt.timedelta(days=1), last_date),
-            "2 jours": (last_date - dt.timedelta(days=2), last_date),
-            "1 semaine": (last_date - dt.timedelta(days=7), last_date),
-            "1 mois": (last_date - dt.timedelta(days=30), last_date),
-            "Tout": (first_date, last_date),
-        },
+        options=get_date_presets(first_date, last_date),
         value=(last_date - dt.timedelta(hours=2), last_date),
     )
 
@@ -151,19 +110,40 @@ def build_dashboard():
         if field_type in ["integer", "float", "boolean"]
     }
 
+    # Presets of the configured measures are prefetched in the background,
+    # started by the first session of the process
+    if "cache_warmer" in analytics_conf:
+        warmer_conf = dict(analytics_conf["cache_warmer"])
+        presets = warmer_conf.pop("presets", None)
+
+        get_cache_warmer(
+            multi_view_connector,
+            [measure[1:] for measure in measures_options.values()],
+            partial(get_warmed_presets, multi_view_connector, presets),
+            POINT_BUDGET,
+            **warmer_conf,
+        ).start()
+
     measures = pn.widgets.MultiChoice(
         name="Measures",
         options=measures_options,
     )
 
-    # Check how bind works
-    plot_widget = pn.bind(
-        plot_measures,
-        multi_view_connector,
+    # Plots are built once per measures selection, widgets push new data
+    measures_view = MeasuresView(multi_view_connector, POINT_BUDGET)
+    pn.bind(
+        measures_view.update,
         measures,
         group_plots,
         smooth_plots,
         date_range_picker,
+        watch=True,
+    )
+    measures_view.update(
+        measures.value, group_plots.value, smooth_plots.value, date_range_picker.value
+    )
+    csv_download = pn.widgets.FileDownload(
+        callback=measures_view.csv, filename="measures.csv", button_type="primary"
     )
 
     pn.extension(sizing_mode="stretch_both")
@@ -175,8 +155,9 @@ def build_dashboard():
             group_plots,
             smooth_plots,
             measures,
+            csv_download,
         ],
-        main=plot_widget,
+        main=measures_view.container,
     )
     return dashboard
 
@@ -0,0 +1,66 @@
+from typing import Iterable
+import datetime as dt
+
+import numpy as np
+import pandas as pd
+
+# Labels are formatted once per month and day of week, with the current locale
+# as strftime would, instead of once per row
+MONTH_NAMES = [dt.date(2000, month, 1).strftime("%B") for month in range(1, 13)]
+DAY_NAMES = [dt.date(2000, 1, 3 + day).strftime("%A") for day in range(7)]
+
+CALENDAR_FEATURES = (
+    "date",
+    "day",
+    "day_of_week",
+    "day_name",
+    "hour",
+    "month",
+    "month_name",
+)
+
+
+def month_name_categorical(times: pd.Series) -> pd.Categorical:
+    # "%B %Y" labels, categories are ordered by time
+    months = times.dt.year.to_numpy() * 12 + times.dt.month.to_numpy() - 1
+    unique_months, codes = np.unique(months, return_inverse=True)
+
+    return pd.Categorical.from_codes(
+        codes,
+        [f"{MONTH_NAMES[month % 12]} {month // 12}" for month in unique_months],
+        ordered=True,
+    )
+
+
+def add_calendar_features(
+    df: pd.DataFrame,
+    features: Iterable[str] = CALENDAR_FEATURES,
+    time_column: str = "_time",
+) -> pd.DataFrame:
+    # Features of the local times of time_column, as small ints and ordered
+    # categoricals (group them with observed=True)
+    times = df[time_column]
+    columns = {}
+
+    for feature in features:
+        if feature == "date":
+            # Local midnight, naive as pd.to_datetime(times.dt.date)
+            columns["date"] = times.dt.normalize().dt.tz_localize(None)
+        elif feature == "day":
+            columns["day"] = times.dt.day.astype(np.int8)
+        elif feature == "day_of_week":
+            columns["day_of_week"] = times.dt.day_of_week.astype(np.int8)
+        elif feature == "day_name":
+            columns["day_name"] = pd.Categorical.from_codes(
+                times.dt.day_of_week, DAY_NAMES, ordered=True
+            )
+        elif feature == "hour":
+            columns["hour"] = times.dt.hour.astype(np.int8)
+        elif feature == "month":
+            columns["month"] = times.dt.month.astype(np.int8)
+        elif feature == "month_name":
+            columns["month_name"] = month_name_categorical(times)
+        else:
+            raise ValueError(f"Unknown calendar feature {feature}")
+
+    return df.assign(**columns)
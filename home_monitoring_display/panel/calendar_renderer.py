@@ -0,0 +1,225 @@
+from io import BytesIO
+from pathlib import Path
+from typing import Dict, List
+import hashlib
+import json
+import math
+import os
+import threading
+
+from joblib import Parallel, delayed
+from matplotlib.figure import Figure
+import numpy as np
+import pandas as pd
+
+from home_monitoring_display.influxdb.query_cache import QueryCache
+from home_monitoring_display.panel.calendar_features import DAY_NAMES
+from home_monitoring_display.panel.monthly_store import MonthAggregates, MonthlyStore
+
+# Day backgrounds by daily apparent power, below each threshold, the last color
+# above every threshold
+CALENDAR_CARD_COLORS = {3000: "green", 7000: "yellow", 8000: "orange"}
+
+PAPP_FIELD = "PAPP"
+
+# Cells are 24 hour units wide, rows are a day high with room for its label
+CELL_WIDTH = 26
+CELL_HEIGHT = 1.4
+
+# Rendered months, keyed by (month, version) so that a month is only drawn
+# again once its data changes
+_calendar_cache = QueryCache(max_size=36, ttl=math.inf)
+
+# Month indexes of the disk caches are updated by one session at a time
+_index_lock = threading.Lock()
+
+
+def day_colors(day_totals: np.ndarray) -> np.ndarray:
+    thresholds = np.array(list(CALENDAR_CARD_COLORS))
+    colors = np.array(list(CALENDAR_CARD_COLORS.values()))
+
+    return colors[
+        np.minimum(
+            np.searchsorted(thresholds, day_totals, side="right"), len(colors) - 1
+        )
+    ]
+
+
+def render_calendar(df_papp_month: pd.DataFrame, max_papp: float) -> bytes:
+    # Hourly bars of every day of the month in one figure, days are laid out
+    # in week rows and weekday columns, as a calendar
+    days = df_papp_month["day"].to_numpy(dtype=np.int64) - 1
+    hours = df_papp_month["hour"].to_numpy(dtype=np.int64)
+    values = np.nan_to_num(df_papp_month[PAPP_FIELD].to_numpy(dtype=np.float64))
+
+    first_date = df_papp_month["date"].min()
+    first_weekday = first_date.replace(day=1).weekday()
+    cell_columns = (days + first_weekday) % 7
+    cell_rows = (days + first_weekday) // 7
+
+    # Days of the month present in the data
+    month_days = np.unique(days)
+    day_totals = np.bincount(days, weights=values, minlength=month_days.max() + 1)
+    day_columns = (month_days + first_weekday) % 7
+    day_rows = (month_days + first_weekday) // 7
+    rows = day_rows.max() + 1
+
+    figure = Figure(figsize=(14, 1.6 * rows))
+    ax = figure.add_axes((0, 0, 1, 0.95))
+
+    ax.bar(
+        day_columns * CELL_WIDTH - 0.5,
+        CELL_HEIGHT - 0.1,
+        width=CELL_WIDTH - 1,
+        bottom=-day_rows * CELL_HEIGHT - 1.05,
+        align="edge",
+        color=day_colors(day_totals[month_days]),
+        alpha=0.4,
+    )
+    ax.bar(
+        cell_columns * CELL_WIDTH + hours,
+        values / max_papp if max_papp > 0 else values,
+        width=0.8,
+        bottom=-cell_rows * CELL_HEIGHT - 1,
+        align="edge",
+        color="tab:blue",
+    )
+
+    for day, column, row in zip(month_days, day_columns, day_rows):
+        ax.text(
+            column * CELL_WIDTH,
+            -row * CELL_HEIGHT + 0.1,
+            f"{DAY_NAMES[column]} {day + 1:02d}",
+            fontsize=9,
+            va="center",
+        )
+
+    ax.set_xlim(-1, 7 * CELL_WIDTH - 1)
+    ax.set_ylim(-rows * CELL_HEIGHT - 0.1, 0.3)
+    ax.set_axis_off()
+    figure.suptitle(first_date.strftime("%B %Y"))
+
+    png = BytesIO()
+    figure.savefig(png, format="png", dpi=80)
+
+    return png.getvalue()
+
+
+def calendar_key(df_papp_month: pd.DataFrame, max_papp: float) -> str:
+    # Content address of a render, past months keep their key across restarts
+    data_hash = hashlib.sha1(
+        pd.util.hash_pandas_object(
+            df_papp_month[["day", "hour", PAPP_FIELD]], index=False
+        ).to_numpy()
+    )
+    data_hash.update(repr(max_papp).encode())
+
+    return data_hash.hexdigest()
+
+
+class PngCache:
+    # Rendered calendars on disk, one <key>.png file per content key. The key
+    # of each month is indexed so that the previous render of a month is
+    # deleted once its data changes
+
+    INDEX_NAME = "index.json"
+
+    def __init__(self, cache_dir: str) -> None:
+        self.cache_dir = Path(cache_dir)
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+
+    def _path(self, key: str) -> Path:
+        return self.cache_dir / f"{key}.png"
+
+    def _replace(self, path: Path, content: bytes) -> None:
+        # Written to a temporary file first so that readers never see a
+        # partial file
+        tmp_path = path.with_suffix(f".{os.getpid()}.{threading.get_ident()}.tmp")
+        tmp_path.write_bytes(content)
+        os.replace(tmp_path, path)
+
+    def _read_index(self) -> Dict[str, str]:
+        try:
+            return json.loads((self.cache_dir / self.INDEX_NAME).read_text())
+        except (FileNotFoundError, ValueError):
+            return {}
+
+    def __contains__(self, key: str) -> bool:
+        return self._path(key).exists()
+
+    def get(self, key: str) -> bytes:
+        try:
+            return self._path(key).read_bytes()
+        except FileNotFoundError:
+            return None
+
+    def put(self, key: str, png: bytes, month_name: str = None) -> None:
+        self._replace(self._path(key), png)
+
+        if month_name is not None:
+            self.index_months({month_name: key})
+
+    def index_months(self, month_keys: Dict[str, str]) -> None:
+        # Renders previously indexed for these months and no longer used by
+        # any month are deleted
+        with _index_lock:
+            index = self._read_index()
+            previous_keys = {index.get(month_name) for month_name in month_keys}
+            index.update(month_keys)
+            self._replace(
+                self.cache_dir / self.INDEX_NAME, json.dumps(index, indent=1).encode()
+            )
+
+        for previous_key in previous_keys - set(index.values()) - {None}:
+            self._path(previous_key).unlink(missing_ok=True)
+
+
+def prerender_calendars(
+    monthly_store: MonthlyStore, png_cache: PngCache, n_jobs: int = -1
+) -> List[str]:
+    # Months missing from the disk cache are rendered in a process pool, past
+    # months are then only rendered once and the open month when it changes
+    months = {
+        month_name: monthly_store[month_name] for month_name in monthly_store.months()
+    }
+    keys = {
+        month_name: calendar_key(month.papp, month.max_papp)
+        for month_name, month in months.items()
+    }
+    missing = [month_name for month_name, key in keys.items() if key not in png_cache]
+
+    pngs = Parallel(n_jobs=n_jobs)(
+        delayed(render_calendar)(months[month_name].papp, months[month_name].max_papp)
+        for month_name in missing
+    )
+
+    for month_name, png in zip(missing, pngs):
+        png_cache.put(keys[month_name], png)
+        _calendar_cache.put((month_name, months[month_name].version), png)
+    png_cache.index_months(keys)
+
+    return missing
+
+
+def get_calendar_png(
+    month_name: str, month: MonthAggregates, png_cache: PngCache = None
+) -> bytes:
+    key = (month_name, month.version)
+
+    png = _calendar_cache.get(key)
+    if png is not None:
+        return png
+
+    if png_cache is not None:
+        content_key = calendar_key(month.papp, month.max_papp)
+        png = png_cache.get(content_key)
+
+    if png is None:
+        png = render_calendar(month.papp, month.max_papp)
+
+        if png_cache is not None:
+            png_cache.put(content_key, png, month_name)
+
+    _calendar_cache.put(key, png)
+
+    return png
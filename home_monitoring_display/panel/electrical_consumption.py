@@ -1,17 +1,25 @@
+from io import BytesIO
 import argparse
 import os
-import datetime as dt
 from pathlib import Path
-from typing import Dict
-from joblib import Parallel, delayed
 import time
 
+import numpy as np
 import pandas as pd
 import panel as pn
 import hvplot.pandas
-import matplotlib.pyplot as plt
 
 from home_monitoring_display.influxdb.query_influxdb import InfluxDBConnector
+from home_monitoring_display.influxdb.connector_registry import get_connector
+from home_monitoring_display.panel.calendar_features import add_calendar_features
+from home_monitoring_display.panel.calendar_renderer import (
+    PngCache,
+    get_calendar_png,
+    prerender_calendars,
+)
+from home_monitoring_display.panel.monthly_store import get_monthly_store
+from home_monitoring_display.panel.partitioned_store import MonthPartitionedStore
+from home_monitoring_display.tariff import Tariff
 from home_monitoring_display.utils import extract_configs, load_config
 
 # TODO Add a cache functionality to speed up queries
@@ -21,123 +29,117 @@ from home_monitoring_display.utils import extract_configs, load_config
 # TODO Use for grid and other plots
 # TODO Add tabs
 
-CALENDAR_CARD_COLORS = {3000: "green", 7000: "yellow", 8000: "orange"}
-
 MEASUREMENT = "teleinfo"
 PAPP_FIELD = "PAPP"
 BASE_FIELD = "BASE"
 
 
-def get_papp(influxdb_client: InfluxDBConnector, papp_cache_file: str) -> pd.DataFrame:
-    if Path(papp_cache_file).exists():
-        df_papp_old = pd.read_parquet(papp_cache_file)
-
-        start_date = df_papp_old._time.max()
-        df_papp_old = df_papp_old[df_papp_old._time < start_date]
-    else:
-        start_date = influxdb_client.query_time_field(
-            MEASUREMENT, PAPP_FIELD, func="first"
-        )
-        df_papp_old = pd.DataFrame()
-
-    # Query papp field
-    df_papp = influxdb_client.query_field(
+def update_store(
+    influxdb_client: InfluxDBConnector,
+    store: MonthPartitionedStore,
+    field: str,
+    aggregation_func: str,
+) -> None:
+    # The last cached hour may be incomplete, it is queried again and replaced
+    start_date = store.last_time()
+    if start_date is None:
+        start_date = influxdb_client.query_time_field(MEASUREMENT, field, func="first")
+
+    # Query field month by month, each month is cached as soon as it arrives so
+    # that only one month of points is held in memory. Only the months of the
+    # new rows are written
+    for df_chunk in influxdb_client.query_field_chunks(
         MEASUREMENT,
-        PAPP_FIELD,
+        field,
         start_date,
         groupby_interval="1h",
-        aggregation_func="mean",
-    )
+        aggregation_func=aggregation_func,
+    ):
+        # Months without any point have no field column
+        if field in df_chunk:
+            store.append(df_chunk[["_time", field]].astype({field: np.float64}))
 
-    # Get time features
-    df_papp["day"] = df_papp._time.dt.day
-    df_papp["day_of_week"] = df_papp._time.dt.day_of_week
-    df_papp["date"] = pd.to_datetime(df_papp._time.dt.date)
-    df_papp["hour"] = df_papp._time.dt.hour
-    df_papp["month_name"] = df_papp._time.apply(lambda d: d.strftime("%B %Y"))
-    df_papp["week"] = df_papp._time.dt.isocalendar().week
-    df_papp["week"] -= df_papp.week.min()
+    # Nothing cached and nothing returned, InfluxDB is likely unreachable
+    if len(store.months()) == 0:
+        raise ValueError(f"No {field} points in cache or returned by InfluxDB")
 
-    df_papp = pd.concat([df_papp_old, df_papp])
 
-    # Caching data
-    df_papp.to_parquet(papp_cache_file)
+def get_papp(influxdb_client: InfluxDBConnector, papp_cache_file: str) -> pd.DataFrame:
+    papp_store = MonthPartitionedStore(papp_cache_file)
+    update_store(influxdb_client, papp_store, PAPP_FIELD, "mean")
 
-    return df_papp
+    # Time features are computed on the whole history once read
+    df_papp = papp_store.read(columns=["_time", PAPP_FIELD])
+    df_papp[PAPP_FIELD] = df_papp[PAPP_FIELD].astype(np.float32)
+
+    return add_calendar_features(
+        df_papp, ("day", "day_of_week", "date", "hour", "month_name")
+    )
 
 
 def get_base_day(
     influxdb_client: InfluxDBConnector,
     base_cache_file: str,
-    energy_prices: Dict[str, float],
+    tariff: Tariff,
 ):
-    if Path(base_cache_file).exists():
-        df_base_day_old = pd.read_parquet(base_cache_file)
-
-        start_date = df_base_day_old._time.max()
-        df_base_day_old = df_base_day_old[df_base_day_old._time < start_date]
-    else:
-        start_date = influxdb_client.query_time_field(
-            MEASUREMENT, BASE_FIELD, func="first"
-        )
-        df_base_day_old = pd.DataFrame()
-
-    # Query base field
-    df_base_day = influxdb_client.query_field(
-        "teleinfo", "BASE", start_date, groupby_interval="1d", aggregation_func="min"
-    )
+    # The consumption of the last cached hour is only known once the next hour
+    # starts, it is queried again and replaced. Hourly, so that off peak hours
+    # are priced
+    base_store = MonthPartitionedStore(base_cache_file)
+    update_store(influxdb_client, base_store, BASE_FIELD, "min")
 
     max_base = influxdb_client.query_last_field("teleinfo", "BASE")
 
-    # Group by date
-    # df_base_day = df_base.groupby("date").agg({"BASE": "min"}).reset_index()
+    # Caches written before were daily, their days are priced at midnight
+    df_base = base_store.read(columns=["_time", BASE_FIELD]).dropna(subset=[BASE_FIELD])
 
-    # Get time features
-    df_base_day["date"] = pd.to_datetime(df_base_day._time.dt.date)
-    df_base_day["day"] = df_base_day.date.apply(lambda d: int(d.strftime("%d")))
-    df_base_day["day_of_week"] = df_base_day.date.apply(lambda d: d.weekday())
-    df_base_day["month_name"] = df_base_day.date.apply(lambda d: d.strftime("%B %Y"))
-
-    # Get energy consumption
-    df_base_day_shift = df_base_day.BASE.shift(-1)
-    df_base_day_shift.iloc[-1] = max_base
-    df_base_day["energy_consumption"] = df_base_day_shift - df_base_day.BASE
-    df_base_day["price"] = df_base_day[["day_of_week", "energy_consumption"]].apply(
-        lambda row: (
-            row["energy_consumption"] * energy_prices["week"] / 1000
-            if row["day_of_week"] < 5
-            else row["energy_consumption"] * energy_prices["weekend"] / 1000
+    # Get energy consumption, the BASE index exceeds float32 precision
+    df_base_shift = df_base.BASE.shift(-1)
+    df_base_shift.iloc[-1] = max_base
+    energy_consumption = (df_base_shift - df_base.BASE).to_numpy()
+
+    df_base = add_calendar_features(
+        df_base.assign(
+            energy_consumption=energy_consumption,
+            price=tariff.price(df_base._time, energy_consumption),
         ),
-        axis=1,
+        ("date",),
     )
 
-    df_base_day = pd.concat([df_base_day_old, df_base_day])
-
-    # Caching data
-    df_base_day.to_parquet(base_cache_file)
+    # Group by date
+    df_base_day = df_base.groupby("date", sort=True).agg(
+        _time=("_time", "first"),
+        BASE=(BASE_FIELD, "first"),
+        energy_consumption=("energy_consumption", "sum"),
+        price=("price", "sum"),
+    )
+    df_base_day["energy_consumption"] = df_base_day.energy_consumption.astype(
+        np.float32
+    )
 
-    return df_base_day
+    # Get time features
+    return add_calendar_features(
+        df_base_day.reset_index(), ("day", "day_of_week", "month_name")
+    )
 
 
 def get_papp_day(df_papp):
     # Group papp by day
     df_papp_day = (
-        df_papp.groupby(["date", "month_name", "day_of_week"])
+        df_papp.groupby(["date", "month_name", "day_of_week"], observed=True)
         .agg({"PAPP": "sum"})
         .reset_index()
     )
 
     # Get time features
-    df_papp_day["day"] = df_papp_day.date.apply(lambda d: int(d.strftime("%d")))
-    df_papp_day["day_name"] = df_papp_day.date.apply(lambda d: d.strftime("%A"))
-    df_papp_day["month"] = df_papp_day.date.apply(lambda d: d.month)
-
-    return df_papp_day
+    return add_calendar_features(
+        df_papp_day, ("day", "day_of_week", "day_name", "month"), time_column="date"
+    )
 
 
 def plot_distrib_bar(df, group, sort_key, title):
     return (
-        df.groupby(list(set((group, sort_key))))
+        df.groupby(list(set((group, sort_key))), observed=True)
         .agg({PAPP_FIELD: "mean"})
         .reset_index()
         .sort_values(sort_key, ascending=True)
@@ -228,13 +230,14 @@ def get_distributions_layout(df_papp, df_papp_day):
 
 
 # Consumption
-def get_consumption_layout(df_papp_day, df_base_day, select_month):
+def get_consumption_layout(monthly_store, select_month):
     @pn.depends(select_month=select_month)
     def get_consumption(select_month):
         starting_time = time.perf_counter()
 
-        df_papp_day_month = df_papp_day[df_papp_day["month_name"] == select_month]
-        df_base_day_month = df_base_day[df_base_day["month_name"] == select_month]
+        month = monthly_store[select_month]
+        df_papp_day_month = month.papp_day
+        df_base_day_month = month.base_day
 
         plot_energy_month = df_papp_day_month[:-1].hvplot.bar(
             x="day",
@@ -247,7 +250,7 @@ def get_consumption_layout(df_papp_day, df_base_day, select_month):
         )
         total_consumption = pn.indicators.Number(
             name="Total consumption",
-            value=df_base_day_month.energy_consumption.sum() / 1000,
+            value=month.total_consumption / 1000,
             format="{value:.3f} kWh",
         )
         plot_price_month = df_base_day_month.hvplot.bar(
@@ -257,7 +260,7 @@ def get_consumption_layout(df_papp_day, df_base_day, select_month):
         )
         total_price = pn.indicators.Number(
             name="Total consumption",
-            value=df_base_day_month.price.sum(),
+            value=month.total_price,
             format="{value:.2f} €",
         )
 
@@ -292,61 +295,23 @@ def get_consumption_layout(df_papp_day, df_base_day, select_month):
 
 
 # Calendar
-def get_calendar_card(df_papp_day, date, max_papp):
-    bar_fig = df_papp_day.plot.bar(
-        x="hour", y=PAPP_FIELD, ylim=(0, max_papp), ylabel="PAPP"
-    ).get_figure()
-
-    title = date.strftime("%A %d %B")
-
-    total_day = df_papp_day[PAPP_FIELD].sum()
-    for thresh, color in CALENDAR_CARD_COLORS.items():
-        background_color = color
-        if total_day < thresh:
-            break
-
-    card = pn.Card(
-        pn.pane.Matplotlib(
-            bar_fig,
-            sizing_mode="stretch_both",
-        ),
-        title=title,
-        collapsible=False,
-        styles={"background": background_color},
-    )
-
-    plt.close()
-
-    return card
-
-
-def get_calendar_layout(df_papp, select_month):
+def get_calendar_layout(monthly_store, select_month, png_cache=None):
     @pn.depends(select_month=select_month)
     def get_calendar(select_month):
         starting_time = time.perf_counter()
 
-        df_papp_month = df_papp[df_papp["month_name"] == select_month]
-        max_papp = df_papp_month[PAPP_FIELD].max()
-
-        min_date = df_papp_month.date.min()
-        min_week = min_date.isocalendar().week
-
-        grid_layout = pn.GridSpec(sizing_mode="stretch_both")
-
-        for date in df_papp_month.date.unique():
-            df_papp_day = df_papp_month[df_papp_month.date == date]
-
-            date = dt.datetime.utcfromtimestamp(int(date) / 1e9)
-
-            grid_layout[
-                date.isocalendar().week - min_week, date.isocalendar().weekday - 1
-            ] = get_calendar_card(df_papp_day, date, max_papp)
+        # Whole month drawn at once, kept until its data changes
+        calendar = pn.pane.PNG(
+            BytesIO(
+                get_calendar_png(select_month, monthly_store[select_month], png_cache)
+            ),
+            sizing_mode="stretch_width",
+        )
 
-        # Only load png plots
         print(f"Calendar layout time {time.perf_counter() - starting_time:.4f} s")
 
         return pn.Card(
-            grid_layout,
+            calendar,
             sizing_mode="stretch_both",
             title="Calendar energy consumption",
             collapsible=True,
@@ -366,7 +331,7 @@ def build_dashboard():
 
     starting_time = time.perf_counter()
 
-    influxdb_client = InfluxDBConnector(
+    influxdb_client = get_connector(
         **connectors_conf[consumption_conf["influxdb_connector"]]
     )
 
@@ -376,19 +341,29 @@ def build_dashboard():
     df_base_day = get_base_day(
         influxdb_client,
         consumption_conf["base_cache_file"],
-        consumption_conf["energy_prices"],
+        Tariff.from_config(consumption_conf["energy_prices"]),
     )
 
     print(f"get data time {time.perf_counter() - starting_time:.4f} s")
 
-    month_list = list(
-        df_papp_day.sort_values("date", ascending=True)["month_name"].unique()
-    )
+    # Per month frames and totals, shared by the sessions and only rebuilt for
+    # the months with new data
+    monthly_store = get_monthly_store(consumption_conf["papp_cache_file"])
+    monthly_store.update(df_papp, df_papp_day, df_base_day)
 
-    select_month = pn.widgets.Select(name="Month", options=month_list)
+    select_month = pn.widgets.Select(name="Month", options=monthly_store.months())
+
+    # Rendered calendars are kept on disk by content, the months without one
+    # are rendered in parallel
+    png_cache = None
+    if "calendar_cache_dir" in consumption_conf:
+        png_cache = PngCache(consumption_conf["calendar_cache_dir"])
+        prerender_calendars(
+            monthly_store, png_cache, consumption_conf.get("calendar_render_jobs", -1)
+        )
 
-    consumption_layout = get_consumption_layout(df_papp_day, df_base_day, select_month)
-    calendar_layout = get_calendar_layout(df_papp, select_month)
+    consumption_layout = get_consumption_layout(monthly_store, select_month)
+    calendar_layout = get_calendar_layout(monthly_store, select_month, png_cache)
     distributions_layout = get_distributions_layout(df_papp, df_papp_day)
 
     layout = pn.template.MaterialTemplate(
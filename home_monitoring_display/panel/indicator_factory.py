@@ -1,9 +1,12 @@
-from typing import Dict, List
+from typing import Callable, Dict, List
 import datetime as dt
 
 import panel as pn
 
 from home_monitoring_display.influxdb.query_influxdb import InfluxDBConnector
+from home_monitoring_display.influxdb.async_query_influxdb import (
+    AsyncInfluxDBConnector,
+)
 
 TIME_IND_MULT = {
     "w": 7 * 24 * 60 * 60 * 1000,
@@ -89,8 +92,73 @@ def strtime_to_ms(strtime: str) -> int:
     return number * TIME_IND_MULT[time_ind]
 
 
+def mark_stale(indicator, influxdb_connector: InfluxDBConnector, measurement: str):
+    # Values served from the last good result while InfluxDB fails are dimmed
+    stale = measurement in influxdb_connector.stale_since
+    indicator.styles = {"opacity": "0.5" if stale else "1"}
+
+
+def build_indicator(
+    influxdb_connector: InfluxDBConnector,
+    init_query: Callable,
+    update_query: Callable,
+    create: Callable,
+    update: Callable,
+    refresh_rate: str,
+    measurement: str = None,
+):
+    period = strtime_to_ms(refresh_rate)
+
+    if not isinstance(influxdb_connector, AsyncInfluxDBConnector):
+        init_value = init_query()
+
+        if init_value is None:
+            return UNAVAILABLE_PANE
+
+        indicator = create(init_value)
+        mark_stale(indicator, influxdb_connector, measurement)
+
+        def update_indicator():
+            value = update_query()
+            if value is not None:
+                update(indicator, value)
+            mark_stale(indicator, influxdb_connector, measurement)
+
+        pn.state.add_periodic_callback(update_indicator, period)
+
+        return indicator
+
+    # Async connectors are only awaited once the page is loaded, the periodic
+    # callbacks then run as coroutines on the server event loop
+    container = pn.Column(sizing_mode="stretch_width")
+
+    async def load_indicator():
+        init_value = await init_query()
+
+        if init_value is None:
+            container.append(UNAVAILABLE_PANE)
+            return
+
+        indicator = create(init_value)
+        mark_stale(indicator, influxdb_connector, measurement)
+        container.append(indicator)
+
+        async def update_indicator():
+            value = await update_query()
+            if value is not None:
+                update(indicator, value)
+            mark_stale(indicator, influxdb_connector, measurement)
+
+        pn.state.add_periodic_callback(update_indicator, period)
+
+    pn.state.onload(load_indicator)
+
+    return container
+
+
 # TODO Fix trend indicator
 
+
 def create_trend(
     influxdb_connector: InfluxDBConnector,
     measurement: str,
@@ -99,36 +167,38 @@ def create_trend(
     window_size: int,
     title: str = "",
 ) -> pn.indicators.Trend:
-    df_init = influxdb_connector.query_field(measurement, field, window_size)
-
-    if df_init is None:
-        return UNAVAILABLE_PANE
+    nb_measures = 0
+
+    def create(df_init):
+        nonlocal nb_measures
+        nb_measures = df_init.shape[0]
+
+        return pn.indicators.Trend(
+            name=title,
+            data=df_init,
+            plot_x="_time",
+            plot_y=field,
+            sizing_mode="stretch_width",
+            height=TREND_HEIGHT,
+            plot_type="area",
+        )
 
-    nb_measures = df_init.shape[0]
+    def update(trend, df_update):
+        trend.stream(
+            df_update,
+            rollover=nb_measures,
+        )
 
-    trend = pn.indicators.Trend(
-        name=title,
-        data=df_init,
-        plot_x="_time",
-        plot_y=field,
-        sizing_mode="stretch_width",
-        height=TREND_HEIGHT,
-        plot_type="area",
+    return build_indicator(
+        influxdb_connector,
+        lambda: influxdb_connector.query_field(measurement, field, window_size),
+        lambda: influxdb_connector.query_field(measurement, field, refresh_rate),
+        create,
+        update,
+        refresh_rate,
+        measurement,
     )
 
-    def update_plot():
-        df_update = influxdb_connector.query_field(measurement, field, refresh_rate)
-
-        if df_update is not None:
-            trend.stream(
-                df_update,
-                rollover=nb_measures,
-            )
-
-    pn.state.add_periodic_callback(update_plot, strtime_to_ms(refresh_rate))
-
-    return trend
-
 
 # TODO Remove duplicate code between number and gauge
 
@@ -146,35 +216,35 @@ def create_number(
     if thresholds is not None:
         thresholds = list(thresholds.items())
 
-    mean_value = influxdb_connector.query_agg_field(measurement, field, refresh_rate)
-
-    if mean_value is None:
-        return UNAVAILABLE_PANE
-
-    if math_operation is not None:
-        mean_value = math_operation(mean_value)
-
-    number = pn.indicators.Number(
-        name=name,
-        value=mean_value,
-        format=string_format,
-        sizing_mode="stretch_width",
-        colors=thresholds,
-    )
-
-    def update_value():
-        mean_value = influxdb_connector.query_agg_field(
-            measurement, field, refresh_rate
+    def apply_operation(mean_value):
+        if math_operation is not None:
+            return math_operation(mean_value)
+        return mean_value
+
+    def create(mean_value):
+        return pn.indicators.Number(
+            name=name,
+            value=apply_operation(mean_value),
+            format=string_format,
+            sizing_mode="stretch_width",
+            colors=thresholds,
         )
-        if mean_value is not None:
-            if math_operation is not None:
-                mean_value = math_operation(mean_value)
 
-            number.value = mean_value
+    def update(number, mean_value):
+        number.value = apply_operation(mean_value)
 
-    pn.state.add_periodic_callback(update_value, strtime_to_ms(refresh_rate))
+    def query_value():
+        return influxdb_connector.query_agg_field(measurement, field, refresh_rate)
 
-    return number
+    return build_indicator(
+        influxdb_connector,
+        query_value,
+        query_value,
+        create,
+        update,
+        refresh_rate,
+        measurement,
+    )
 
 
 def create_gauge(
@@ -190,30 +260,31 @@ def create_gauge(
     if thresholds is not None:
         thresholds = list(thresholds.items())
 
-    mean_value = influxdb_connector.query_agg_field(measurement, field, refresh_rate)
-
-    if mean_value is None:
-        return UNAVAILABLE_PANE
-
-    gauge = pn.indicators.Gauge(
-        name=name,
-        value=int(mean_value),
-        format="{value}" + format_suffix,
-        bounds=tuple(bounds),
-        sizing_mode="stretch_width",
-        colors=thresholds,
-    )
-
-    def update_value():
-        mean_value = influxdb_connector.query_agg_field(
-            measurement, field, refresh_rate
+    def create(mean_value):
+        return pn.indicators.Gauge(
+            name=name,
+            value=int(mean_value),
+            format="{value}" + format_suffix,
+            bounds=tuple(bounds),
+            sizing_mode="stretch_width",
+            colors=thresholds,
         )
-        if mean_value is not None:
-            gauge.value = int(mean_value)
 
-    pn.state.add_periodic_callback(update_value, strtime_to_ms(refresh_rate))
+    def update(gauge, mean_value):
+        gauge.value = int(mean_value)
+
+    def query_value():
+        return influxdb_connector.query_agg_field(measurement, field, refresh_rate)
 
-    return gauge
+    return build_indicator(
+        influxdb_connector,
+        query_value,
+        query_value,
+        create,
+        update,
+        refresh_rate,
+        measurement,
+    )
 
 
 def icon_url(weather_description: str) -> str:
@@ -237,30 +308,33 @@ def create_weather_icon(
     field: str,
     refresh_rate: int,
 ):
-    weather_description = influxdb_connector.query_last_field(measurement, field)
-
-    if weather_description is None:
-        return UNAVAILABLE_PANE
-
-    pane_image = pn.pane.PNG(
-        icon_url(weather_description),
-        max_height=350,
-        max_width=350,
-        sizing_mode="stretch_width",
-    )
-    text_description = pn.widgets.StaticText(
-        value=f"<h2>{weather_description}</h2>", align="center"
-    )
-
-    weather_icon = pn.Column(pane_image, text_description)
+    def create(weather_description):
+        pane_image = pn.pane.PNG(
+            icon_url(weather_description),
+            max_height=350,
+            max_width=350,
+            sizing_mode="stretch_width",
+        )
+        text_description = pn.widgets.StaticText(
+            value=f"<h2>{weather_description}</h2>", align="center"
+        )
 
-    def update_value():
-        weather_description = influxdb_connector.query_last_field(measurement, field)
+        return pn.Column(pane_image, text_description)
 
-        if weather_description is not None:
-            pane_image.object = icon_url(weather_description)
-            text_description.value = weather_description
+    def update(weather_icon, weather_description):
+        pane_image, text_description = weather_icon
+        pane_image.object = icon_url(weather_description)
+        text_description.value = weather_description
 
-    pn.state.add_periodic_callback(update_value, strtime_to_ms(refresh_rate))
+    def query_value():
+        return influxdb_connector.query_last_field(measurement, field)
 
-    return weather_icon
+    return build_indicator(
+        influxdb_connector,
+        query_value,
+        query_value,
+        create,
+        update,
+        refresh_rate,
+        measurement,
+    )
@@ -0,0 +1,126 @@
+from functools import partial, reduce
+from io import StringIO
+from typing import List, Tuple, Union
+
+import holoviews as hv
+import pandas as pd
+import panel as pn
+
+from home_monitoring_display.influxdb.multi_view_connector import MultiViewConnector
+from home_monitoring_display.panel.range_loader import RangeLoader
+
+
+def plot_measure(label: str, field: str, data: pd.DataFrame) -> hv.Curve:
+    # data is the frame sent to the measure pipe, plotted without copy
+    return hv.Curve(data, "_time", field, label=label).opts(
+        framewise=True, responsive=True
+    )
+
+
+def plot_aligned(
+    labels: List[str], fields: List[str], data: Union[pd.DataFrame, List]
+) -> hv.Overlay:
+    # One curve per column of the aligned frame, sharing its time column, or
+    # one curve per measure frame when the measures are not bucketed
+    if data is None or isinstance(data, pd.DataFrame):
+        curves = [hv.Curve(data, "_time", label, label=label) for label in labels]
+    else:
+        curves = [
+            hv.Curve(df, "_time", field, label=label)
+            for label, field, df in zip(labels, fields, data)
+        ]
+
+    return hv.Overlay(curves).opts(show_legend=True, framewise=True, responsive=True)
+
+
+class MeasuresView:
+    # Plots of the selected measures, built once per selection. Range and
+    # smoothing changes push new data to the existing glyphs through the
+    # measure pipes, group mode switches between two views of the same plots
+
+    def __init__(
+        self, multi_view_connector: MultiViewConnector, point_budget: int
+    ) -> None:
+        self.multi_view_connector = multi_view_connector
+        self.point_budget = point_budget
+
+        self.container = pn.Column(sizing_mode="stretch_both")
+
+        self._measures = None
+        self._range_loader = None
+        self._plots = []
+        self._panes = {}
+        self._date_range = None
+
+    def _build(self, measures: List[Tuple]) -> None:
+        self._measures = measures
+        labels = [" ".join((measure[0], measure[3])) for measure in measures]
+        self._range_loader = RangeLoader(
+            self.multi_view_connector,
+            [measure[1:] for measure in measures],
+            True,
+            self.point_budget,
+            labels=labels,
+        )
+
+        self._plots = [
+            hv.DynamicMap(partial(plot_measure, label, measure[3]), streams=[pipe])
+            for measure, label, pipe in zip(measures, labels, self._range_loader.pipes)
+        ]
+        # Grouped measures are plotted from one frame aligned on a time grid
+        self._aligned_plot = hv.DynamicMap(
+            partial(plot_aligned, labels, [measure[3] for measure in measures]),
+            streams=[self._range_loader.aligned_pipe],
+        )
+
+        # Zooming loads the visible range at its own resolution, plots share
+        # their time axis
+        for plot in (self._plots[0], self._aligned_plot):
+            range_stream = hv.streams.RangeX(source=plot)
+            range_stream.add_subscriber(self._range_loader.request)
+
+        self._panes = {}
+        self.container.objects = []
+
+    def _show(self, group_plots: bool) -> None:
+        # Views are created once and hidden rather than rebuilt
+        if group_plots not in self._panes:
+            if group_plots:
+                plot = self._aligned_plot
+            else:
+                plot = reduce(lambda x, y: x + y, self._plots).cols(1)
+
+            self._panes[group_plots] = pn.pane.HoloViews(
+                plot, sizing_mode="stretch_both"
+            )
+            self.container.append(self._panes[group_plots])
+
+        for group, pane in self._panes.items():
+            pane.visible = group == group_plots
+
+    def update(self, measures, group_plots, smooth_plots, date_range) -> None:
+        if len(measures) == 0:
+            self._measures = None
+            self.container.objects = [pn.pane.Markdown("## No measures Selected")]
+            return
+
+        if measures != self._measures:
+            self._build(measures)
+
+        # Local times, localized by the multi view connector. Without smoothing
+        # raw points are plotted, capped by the connector
+        group_plots = group_plots or len(measures) == 1
+        self._date_range = (pd.Timestamp(date_range[0]), pd.Timestamp(date_range[1]))
+        self._range_loader.smooth = smooth_plots
+        self._range_loader.group = group_plots
+        self._range_loader.load(*self._date_range)
+
+        self._show(group_plots)
+
+    def csv(self) -> StringIO:
+        # Selected measures of the selected range, aligned as when grouped
+        if self._measures is None:
+            return StringIO()
+
+        df_aligned = self._range_loader.aligned(*self._date_range)
+        return StringIO(df_aligned.to_csv(index=False))
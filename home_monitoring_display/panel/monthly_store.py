@@ -0,0 +1,124 @@
+from typing import Dict, List, NamedTuple, Tuple
+import itertools
+import threading
+
+import pandas as pd
+
+PAPP_FIELD = "PAPP"
+
+# Versions are unique across stores, renders are cached by (month, version)
+_versions = itertools.count(1)
+
+
+class MonthAggregates(NamedTuple):
+    # Rows of a month in each consumption frame, with its totals and maximum.
+    # version changes whenever the rows of the month change
+    version: int
+    papp: pd.DataFrame
+    papp_day: pd.DataFrame
+    base_day: pd.DataFrame
+    max_papp: float
+    total_consumption: float
+    total_price: float
+
+
+def _split_months(df: pd.DataFrame) -> Dict[str, pd.DataFrame]:
+    # Rows of every month in a single pass
+    return {
+        str(month_name): df_month
+        for month_name, df_month in df.groupby("month_name", observed=True, sort=False)
+    }
+
+
+def _signature(df: pd.DataFrame, time_column: str, value_column: str) -> Tuple:
+    if len(df) == 0:
+        return (0,)
+
+    return (
+        len(df),
+        df[time_column].iloc[-1].value,
+        float(df[value_column].sum()),
+    )
+
+
+class MonthlyStore:
+    # Consumption frames materialized per month, so that a month selection is
+    # a lookup rather than masks and aggregations over the whole history.
+    # Updates only rebuild the months whose rows changed, usually the last one
+
+    def __init__(self) -> None:
+        self._months = {}
+        self._signatures = {}
+        self._month_list = []
+        self._lock = threading.Lock()
+
+    def update(
+        self,
+        df_papp: pd.DataFrame,
+        df_papp_day: pd.DataFrame,
+        df_base_day: pd.DataFrame,
+    ) -> List[str]:
+        # Returns the months that were rebuilt
+        papp_months = _split_months(df_papp)
+        papp_day_months = _split_months(df_papp_day)
+        base_day_months = _split_months(df_base_day)
+        empty_base_day = df_base_day.iloc[:0]
+
+        updated = []
+
+        with self._lock:
+            for month_name, df_papp_month in papp_months.items():
+                df_papp_day_month = papp_day_months.get(
+                    month_name, df_papp_day.iloc[:0]
+                )
+                df_base_day_month = base_day_months.get(month_name, empty_base_day)
+
+                signature = (
+                    _signature(df_papp_month, "_time", PAPP_FIELD),
+                    _signature(df_base_day_month, "_time", "energy_consumption"),
+                    _signature(df_base_day_month, "_time", "price"),
+                )
+                if self._signatures.get(month_name) == signature:
+                    continue
+
+                self._months[month_name] = MonthAggregates(
+                    version=next(_versions),
+                    papp=df_papp_month,
+                    papp_day=df_papp_day_month,
+                    base_day=df_base_day_month,
+                    max_papp=float(df_papp_month[PAPP_FIELD].max()),
+                    total_consumption=float(df_base_day_month.energy_consumption.sum()),
+                    total_price=float(df_base_day_month.price.sum()),
+                )
+                self._signatures[month_name] = signature
+                updated.append(month_name)
+
+            # Months in time order, month names are ordered categoricals
+            self._month_list = [
+                month_name
+                for month_name in df_papp.month_name.cat.categories
+                if month_name in papp_months
+            ]
+
+        return updated
+
+    def months(self) -> List[str]:
+        with self._lock:
+            return list(self._month_list)
+
+    def __getitem__(self, month_name: str) -> MonthAggregates:
+        with self._lock:
+            return self._months[month_name]
+
+
+# Stores shared by the dashboard sessions of the process, keyed by cache file
+_monthly_stores = {}
+_monthly_stores_lock = threading.Lock()
+
+
+def get_monthly_store(key: str) -> MonthlyStore:
+    with _monthly_stores_lock:
+        if key not in _monthly_stores:
+            _monthly_stores[key] = MonthlyStore()
+
+        return _monthly_stores[key]
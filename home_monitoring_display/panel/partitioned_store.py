@@ -0,0 +1,186 @@
+from pathlib import Path
+from typing import List
+import os
+import shutil
+import threading
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+# Rows of a month are written in row groups of about a day of hourly points,
+# so that row group statistics also skip days of a month
+ROW_GROUP_SIZE = 24 * 8
+
+# Writes to a store are serialized across the instances of the process, keyed
+# by directory
+_path_locks = {}
+_path_locks_lock = threading.Lock()
+
+
+def get_path_lock(path: str) -> threading.Lock:
+    key = str(Path(path).resolve())
+
+    with _path_locks_lock:
+        if key not in _path_locks:
+            _path_locks[key] = threading.Lock()
+
+        return _path_locks[key]
+
+
+class MonthPartitionedStore:
+    # Append only frame partitioned by month of its time column, one zstd
+    # parquet file per month (month=YYYY-MM/data.parquet). Closed months are
+    # written once, appending rows only rewrites the months they fall in,
+    # usually the open one. Reads are pushed down to the partitions and row
+    # groups of the requested range
+
+    def __init__(self, path: str, time_column: str = "_time") -> None:
+        self.path = Path(path)
+        self.time_column = time_column
+        self._lock = get_path_lock(path)
+
+        # Previous caches were a single parquet file at the same path
+        with self._lock:
+            if self.path.is_file():
+                self._migrate()
+
+    def _migrate(self) -> None:
+        df = pd.read_parquet(self.path)
+
+        tmp_path = self.path.with_name(
+            f"{self.path.name}.{os.getpid()}.{threading.get_ident()}.tmp"
+        )
+        self._write_months(df, tmp_path)
+        self.path.unlink()
+        os.replace(tmp_path, self.path)
+
+    @staticmethod
+    def _month_numbers(times: pd.Series) -> pd.Series:
+        # Months of the local times as YYYYMM integers
+        return times.dt.year * 100 + times.dt.month
+
+    @staticmethod
+    def _month_name(month_number: int) -> str:
+        return f"{month_number // 100}-{month_number % 100:02d}"
+
+    def _month_of(self, time: pd.Timestamp) -> str:
+        return self._month_name(time.year * 100 + time.month)
+
+    def _month_path(self, month: str, root: Path = None) -> Path:
+        return (root or self.path) / f"month={month}" / "data.parquet"
+
+    def _write_months(self, df: pd.DataFrame, root: Path = None) -> None:
+        for month_number, df_month in df.groupby(
+            self._month_numbers(df[self.time_column]), sort=False
+        ):
+            path = self._month_path(self._month_name(month_number), root)
+            path.parent.mkdir(parents=True, exist_ok=True)
+
+            # Written to a temporary file first so that readers never see a
+            # partial month, hidden files are not part of the dataset
+            table = pa.Table.from_pandas(
+                df_month.sort_values(self.time_column), preserve_index=False
+            )
+            tmp_path = path.with_name(
+                f".{path.name}.{os.getpid()}.{threading.get_ident()}.tmp"
+            )
+            pq.write_table(
+                table,
+                tmp_path,
+                compression="zstd",
+                row_group_size=ROW_GROUP_SIZE,
+                write_statistics=True,
+            )
+            os.replace(tmp_path, path)
+
+    def months(self) -> List[str]:
+        return sorted(path.name.split("=", 1)[1] for path in self.path.glob("month=*"))
+
+    def last_time(self) -> pd.Timestamp:
+        # Read from the statistics of the last row group of the open month
+        months = self.months()
+        if len(months) == 0:
+            return None
+
+        parquet_file = pq.ParquetFile(self._month_path(months[-1]))
+        metadata = parquet_file.metadata
+        column = parquet_file.schema_arrow.get_field_index(self.time_column)
+
+        time_type = parquet_file.schema_arrow.field(column).type
+        last_time = (
+            metadata.row_group(metadata.num_row_groups - 1)
+            .column(column)
+            .statistics.max
+        )
+        last_time = pd.Timestamp(last_time)
+        if time_type.tz is None:
+            return last_time
+
+        # Statistics of zoned times are UTC instants
+        if last_time.tzinfo is None:
+            last_time = last_time.tz_localize("UTC")
+        return last_time.tz_convert(time_type.tz)
+
+    def read(
+        self,
+        start: pd.Timestamp = None,
+        stop: pd.Timestamp = None,
+        columns: List[str] = None,
+    ) -> pd.DataFrame:
+        # Rows of [start, stop), only the partitions and row groups that may
+        # hold them are read
+        if len(self.months()) == 0:
+            return pd.DataFrame()
+
+        dataset = ds.dataset(self.path, format="parquet", partitioning="hive")
+
+        expression = None
+        if start is not None:
+            expression = (ds.field("month") >= self._month_of(start)) & (
+                ds.field(self.time_column) >= start
+            )
+        if stop is not None:
+            stop_expression = (ds.field("month") <= self._month_of(stop)) & (
+                ds.field(self.time_column) < stop
+            )
+            expression = (
+                stop_expression if expression is None else expression & stop_expression
+            )
+
+        if columns is None:
+            columns = [name for name in dataset.schema.names if name != "month"]
+
+        return dataset.to_table(columns=columns, filter=expression).to_pandas()
+
+    def append(self, df: pd.DataFrame) -> None:
+        # Stored rows from the first appended time on are replaced, only the
+        # months of the appended rows are written
+        if len(df) == 0:
+            return
+
+        first_month = self._month_of(df[self.time_column].min())
+        appended_months = {
+            self._month_name(month_number)
+            for month_number in self._month_numbers(df[self.time_column]).unique()
+        }
+        kept = []
+
+        with self._lock:
+            for month in self.months():
+                if month < first_month:
+                    continue
+
+                if month in appended_months:
+                    df_month = pd.read_parquet(self._month_path(month))
+                    kept.append(
+                        df_month[
+                            df_month[self.time_column] < df[self.time_column].min()
+                        ]
+                    )
+                else:
+                    # Only replaced rows were stored in this month
+                    shutil.rmtree(self._month_path(month).parent)
+
+            self._write_months(pd.concat(kept + [df], ignore_index=True))
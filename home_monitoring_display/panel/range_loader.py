@@ -0,0 +1,191 @@
+from concurrent.futures import CancelledError, ThreadPoolExecutor
+from typing import Callable, List, Tuple
+import asyncio
+
+import holoviews as hv
+import numpy as np
+import pandas as pd
+import panel as pn
+
+from home_monitoring_display.influxdb.multi_view_connector import MultiViewConnector
+
+# Range loads run outside of the Bokeh event loop
+_executor = ThreadPoolExecutor(max_workers=4)
+
+
+class RangeLoader:
+    # Loads the measures of the visible range into one Pipe per measure. Range
+    # events closer than debounce seconds are merged and a load superseded by a
+    # newer range or selection stops before its next InfluxDB request
+
+    def __init__(
+        self,
+        multi_view_connector: MultiViewConnector,
+        measures: List[Tuple[str, str, str]],
+        smooth: bool,
+        point_budget: int,
+        debounce: float = 0.3,
+        labels: List[str] = None,
+        group: bool = False,
+    ) -> None:
+        self.multi_view_connector = multi_view_connector
+        self.measures = measures
+        self.smooth = smooth
+        self.point_budget = point_budget
+        self.debounce = debounce
+        self.labels = labels
+        self.group = group
+
+        self.pipes = [hv.streams.Pipe(data=None) for _ in measures]
+        # Wide frame of the measures aligned on a shared time grid, or the list
+        # of their frames when they are not bucketed
+        self.aligned_pipe = hv.streams.Pipe(data=None)
+
+        self._generation = 0
+        self._task = None
+        self._document = None
+        self._loaded_range = None
+
+    def _interval(self, start: pd.Timestamp, stop: pd.Timestamp) -> str:
+        # Resolution is planned for the range, so that zooming in gets finer data
+        if not self.smooth:
+            return None
+
+        return self.multi_view_connector.plan_interval(
+            self.measures, start, stop, self.point_budget
+        )
+
+    def aligned(
+        self,
+        start: pd.Timestamp,
+        stop: pd.Timestamp,
+        groupby_interval: str = None,
+        cancelled: Callable[[], bool] = None,
+    ) -> pd.DataFrame:
+        if groupby_interval is None:
+            groupby_interval = self._interval(start, stop)
+
+        # Raw points are sampled on a grid of about point_budget times
+        if groupby_interval is None:
+            step = max((stop - start).total_seconds() / self.point_budget, 1)
+            groupby_interval = f"{int(np.ceil(step))}s"
+
+        return self.multi_view_connector.query_aligned(
+            self.measures, start, stop, groupby_interval, self.labels, cancelled
+        )
+
+    def query(
+        self, start: pd.Timestamp, stop: pd.Timestamp, generation: int = None
+    ) -> List[Tuple[hv.streams.Pipe, pd.DataFrame]]:
+        def cancelled():
+            return generation is not None and generation != self._generation
+
+        groupby_interval = self._interval(start, stop)
+        if cancelled():
+            return None
+
+        def localize(df):
+            # Plotted with local times, range events come back as local times
+            return df.assign(_time=df["_time"].dt.tz_localize(None))
+
+        # Grouped plots share one aligned frame when the measures are bucketed
+        # on the same times. As-of joined raw points would drop the peaks
+        # between grid times, the min/max decimated frames of the measures are
+        # sent instead
+        try:
+            if self.group and self.multi_view_connector.bucketed(
+                self.measures, groupby_interval
+            ):
+                return [
+                    (
+                        self.aligned_pipe,
+                        localize(
+                            self.aligned(start, stop, groupby_interval, cancelled)
+                        ),
+                    )
+                ]
+
+            measures_frames = [
+                localize(df)
+                for df in self.multi_view_connector.query_measures(
+                    self.measures, groupby_interval, start, stop, cancelled=cancelled
+                )
+            ]
+        except CancelledError:
+            return None
+
+        if self.group:
+            return [(self.aligned_pipe, measures_frames)]
+        return list(zip(self.pipes, measures_frames))
+
+    def load(self, start: pd.Timestamp, stop: pd.Timestamp) -> None:
+        # Selections are loaded right away, on the same path as range events.
+        # Axes refitted meanwhile send back the range, which is not reloaded
+        self._loaded_range = (start, stop)
+
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            # Outside of a server (notebook), loaded in place
+            self._generation += 1
+            self._send(self.query(start, stop))
+            return
+
+        self._schedule(start, stop, 0)
+
+    def _is_loaded(self, start: pd.Timestamp, stop: pd.Timestamp) -> bool:
+        # Axes fitted to pushed data send back about the loaded range
+        if self._loaded_range is None:
+            return False
+
+        tolerance = (self._loaded_range[1] - self._loaded_range[0]) * 0.01
+        return (
+            abs(start - self._loaded_range[0]) <= tolerance
+            and abs(stop - self._loaded_range[1]) <= tolerance
+        )
+
+    def _send(self, sent_frames: List[Tuple[hv.streams.Pipe, pd.DataFrame]]) -> None:
+        for pipe, df in sent_frames:
+            pipe.send(df)
+
+    def request(self, x_range: Tuple = None, **kwargs) -> None:
+        # Subscriber of the range stream, called on the Bokeh event loop
+        if x_range is None:
+            return
+
+        start, stop = map(pd.Timestamp, x_range)
+        if self._is_loaded(start, stop):
+            return
+
+        self._schedule(start, stop, self.debounce)
+
+    def _schedule(self, start: pd.Timestamp, stop: pd.Timestamp, delay: float):
+        # Supersedes the pending load, called on the Bokeh event loop
+        self._generation += 1
+        self._document = pn.state.curdoc
+
+        if self._task is not None:
+            self._task.cancel()
+        self._task = asyncio.ensure_future(
+            self._load_range(self._generation, start, stop, delay)
+        )
+
+    async def _load_range(
+        self, generation: int, start: pd.Timestamp, stop: pd.Timestamp, delay: float
+    ) -> None:
+        # Cancelled while waiting when a newer range comes in, then stopped by
+        # the generation check before each request
+        await asyncio.sleep(delay)
+
+        sent_frames = await asyncio.get_running_loop().run_in_executor(
+            _executor, self.query, start, stop, generation
+        )
+
+        if sent_frames is None or generation != self._generation:
+            return
+        self._loaded_range = (start, stop)
+
+        if self._document is not None:
+            self._document.add_next_tick_callback(lambda: self._send(sent_frames))
+        else:
+            self._send(sent_frames)
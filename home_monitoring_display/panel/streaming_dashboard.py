@@ -8,10 +8,12 @@ import panel as pn
 
 from home_monitoring_display.utils import extract_configs
 from home_monitoring_display.influxdb.query_influxdb import InfluxDBConnector
+from home_monitoring_display.influxdb.async_query_influxdb import (
+    AsyncInfluxDBConnector,
+)
+from home_monitoring_display.influxdb.connector_registry import get_connectors
 from home_monitoring_display.panel import indicator_factory
 
-# TODO: make it work even with one sensor unavailable
-
 def construct_row(influxdb_connector: InfluxDBConnector, indicators_layout: List[Dict]) -> List:
     row_layout = []
 
@@ -62,9 +64,7 @@ def build_dashboard():
         Path(args.conf_directory), "streaming_config.yaml", "connectors_config.yaml"
     ).values()
 
-    influxdb_connectors = {
-        name: InfluxDBConnector(**config) for name, config in connectors_conf.items()
-    }
+    influxdb_connectors = get_connectors(connectors_conf, AsyncInfluxDBConnector)
 
     layout_list = []
 
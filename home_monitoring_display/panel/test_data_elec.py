@@ -3,6 +3,7 @@ from pathlib import Path
 import argparse
 
 from home_monitoring_display.influxdb.query_influxdb import InfluxDBConnector
+from home_monitoring_display.panel.calendar_features import add_calendar_features
 from home_monitoring_display.utils import extract_configs
 
 
@@ -26,23 +27,19 @@ def test_data_processing():
     # get_data()
 
     df_papp = influxdb_client.query_field("teleinfo", "PAPP", start_date, groupby_interval="1h", aggregation_func="mean")
-    df_papp["day"] = df_papp._time.dt.day
-    df_papp["day_of_week"] = df_papp._time.dt.day_of_week
-    df_papp["date"] = df_papp._time.dt.date
-    df_papp["hour"] = df_papp._time.dt.hour
-    df_papp["month_name"] = df_papp._time.apply(lambda d: d.strftime("%B %Y"))
-    df_papp["week"] = df_papp._time.dt.isocalendar().week
-    df_papp["week"] -= df_papp.week.min()
+    df_papp = add_calendar_features(
+        df_papp, ("day", "day_of_week", "date", "hour", "month_name")
+    )
 
 
     df_papp_day = (
-        df_papp.groupby(["date", "month_name", "day_of_week"])
+        df_papp.groupby(["date", "month_name", "day_of_week"], observed=True)
         .agg({"PAPP": "sum"})
         .reset_index()
     )
-    df_papp_day["day"] = df_papp_day.date.apply(lambda d: int(d.strftime("%d")))
-    df_papp_day["day_name"] = df_papp_day.date.apply(lambda d: d.strftime("%A"))
-    df_papp_day["month"] = df_papp_day.date.apply(lambda d: d.month) 
+    df_papp_day = add_calendar_features(
+        df_papp_day, ("day", "day_of_week", "day_name", "month"), time_column="date"
+    )
 
     df_base = influxdb_client.query_field(
         "teleinfo", "BASE", start_date, groupby_interval="1h", aggregation_func="min"
@@ -50,11 +47,11 @@ def test_data_processing():
 
     current_price = {"week": 0.2352, "weekend": 0.1650}
 
-    df_base["date"] = df_base._time.dt.date
+    df_base = add_calendar_features(df_base, ("date",))
     df_base_day = df_base.groupby("date").agg({"BASE": "min"}).reset_index()
-    df_base_day["day"] = df_base_day.date.apply(lambda d: int(d.strftime("%d")))
-    df_base_day["day_of_week"] = df_base_day.date.apply(lambda d: d.weekday())
-    df_base_day["month_name"] = df_base_day.date.apply(lambda d: d.strftime("%B %Y"))
+    df_base_day = add_calendar_features(
+        df_base_day, ("day", "day_of_week", "month_name"), time_column="date"
+    )
 
     query_max = f"SELECT last(BASE) AS BASE FROM teleinfo"
     max_base = influxdb_client.client.query(query_max)["teleinfo"]["BASE"].values[0]
@@ -0,0 +1,106 @@
+from typing import Dict, List, NamedTuple, Sequence, Tuple, Union
+
+import numpy as np
+import pandas as pd
+
+
+class TariffPeriod(NamedTuple):
+    # Prices in €/kWh from start on (None for the first period). Off peak hours
+    # are [start_hour, end_hour) ranges, which may wrap around midnight, and
+    # apply every day
+    start: pd.Timestamp
+    week: float
+    weekend: float
+    off_peak: float = None
+    off_peak_hours: Tuple[Tuple[int, int], ...] = ()
+
+    def price_table(self) -> np.ndarray:
+        # Price of each (day of week, hour)
+        table = np.empty((7, 24))
+        table[:5] = self.week
+        table[5:] = self.weekend
+
+        if self.off_peak is not None:
+            hours = np.zeros(24, dtype=bool)
+            for start_hour, end_hour in self.off_peak_hours:
+                if start_hour < end_hour:
+                    hours[start_hour:end_hour] = True
+                else:
+                    hours[start_hour:] = True
+                    hours[:end_hour] = True
+            table[:, hours] = self.off_peak
+
+        return table
+
+
+class Tariff:
+    # Time of use energy prices, evaluated for many times at once with a
+    # lookup in a (period, day of week, hour) price table
+
+    def __init__(self, periods: Sequence[TariffPeriod]) -> None:
+        self.periods = sorted(
+            periods,
+            key=lambda period: (period.start is not None, period.start),
+        )
+        self._tables = np.stack([period.price_table() for period in self.periods])
+
+    @classmethod
+    def from_config(cls, energy_prices: Union[Dict, List[Dict]]) -> "Tariff":
+        # Either {week: .., weekend: ..} or a list of such prices with a since
+        # date and optional off_peak: {price: .., hours: [[22, 6], ..]}
+        if isinstance(energy_prices, dict):
+            energy_prices = [energy_prices]
+
+        return cls(
+            [
+                TariffPeriod(
+                    start=(
+                        pd.Timestamp(prices["since"]) if "since" in prices else None
+                    ),
+                    week=prices["week"],
+                    weekend=prices["weekend"],
+                    off_peak=prices.get("off_peak", {}).get("price"),
+                    off_peak_hours=tuple(
+                        tuple(hours)
+                        for hours in prices.get("off_peak", {}).get("hours", [])
+                    ),
+                )
+                for prices in energy_prices
+            ]
+        )
+
+    def _period_indices(self, times: pd.DatetimeIndex) -> np.ndarray:
+        # Period starts are local dates, as the times days and hours
+        starts = np.array(
+            [
+                (
+                    period.start.tz_localize(times.tz)
+                    if times.tz is not None and period.start.tzinfo is None
+                    else period.start
+                ).value
+                for period in self.periods
+                if period.start is not None
+            ],
+            dtype=np.int64,
+        )
+        offset = 1 if self.periods[0].start is None else 0
+
+        indices = np.searchsorted(starts, times.asi8, side="right") - 1 + offset
+        # Times before every dated period use the first one
+        return np.maximum(indices, 0)
+
+    def prices(self, times: Union[pd.Series, pd.DatetimeIndex]) -> np.ndarray:
+        # €/kWh at each of the times (local times)
+        times = pd.DatetimeIndex(times)
+
+        return self._tables[
+            self._period_indices(times),
+            times.dayofweek.to_numpy(),
+            times.hour.to_numpy(),
+        ]
+
+    def price(
+        self, times: Union[pd.Series, pd.DatetimeIndex], energy: np.ndarray
+    ) -> np.ndarray:
+        # € of the energy (Wh) consumed from each of the times
+        return np.asarray(energy, dtype=np.float64) / 1000 * self.prices(times)